@@ -0,0 +1,23 @@
+import uuid
+
+from project import create_app, mysql
+
+# fixed namespace so every run generates the same IDs
+BENCH_NAMESPACE = uuid.UUID('6f1c5c1e-8d2b-4c3a-9e57-3b0b6a1f0c42')
+BENCH_PASSWORD = 'benchpass'
+
+
+def make_id(kind: str, number: int):
+    """Deterministic UUID of the number-th generated row of a kind."""
+    return str(uuid.uuid5(BENCH_NAMESPACE, f'{kind}-{number}'))
+
+
+def make_app(database=None, **config):
+    """create_app() pointed at another database and with config overrides."""
+    app = create_app()
+    app.config.update(config)
+    if database:
+        app.config['MYSQL_DB'] = database
+    # the pools were built from the original config in create_app
+    mysql.create_pools(app)
+    return app
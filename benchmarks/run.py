@@ -0,0 +1,241 @@
+"""Benchmark the main routes with the Flask test client.
+
+    python -m benchmarks.run --db photosite_bench --save baseline
+    python -m benchmarks.run --db photosite_bench --compare benchmarks/baselines/baseline.json
+
+Reports p50/p95/p99 latency and SQL statement counts per route. Statement
+counts come from the Server-Timing header added by project/metrics.py.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import time
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.common import make_app
+from project import fragments, mysql, sessions
+from project.cache import Cache
+from project.utils import encode_cursor
+import project.db
+
+BASELINE_FOLDER = os.path.join(os.path.dirname(__file__), 'baselines')
+# gallery page reached by the deep-page routes
+DEEP_PAGE = 50
+GALLERY_PER_PAGE = 8  # per_page of the gallery view
+SERVER_TIMING = re.compile(r'dur=([\d.]+);desc="(\d+) queries"')
+
+
+def _one(sql, params=()):
+    cur = mysql.connection.cursor()
+    cur.execute(sql, params)
+    row = cur.fetchone()
+    cur.close()
+    return row
+
+
+def _deep_cursor(category_id=None):
+    # cursor of the last image on the page before DEEP_PAGE
+    offset = (DEEP_PAGE - 1) * GALLERY_PER_PAGE - 1
+    if category_id:
+        row = _one("""
+            SELECT updateDate, imageID FROM ImageCategory
+            WHERE categoryID = %s AND isVisible = TRUE
+            ORDER BY updateDate DESC, imageID DESC
+            LIMIT 1 OFFSET %s
+        """, (category_id, offset))
+    else:
+        row = _one("""
+            SELECT updateDate, imageID FROM Image
+            WHERE isDeleted = FALSE AND imageStatus = 'Active'
+            ORDER BY updateDate DESC, imageID DESC
+            LIMIT 1 OFFSET %s
+        """, (offset,))
+    return encode_cursor(row['updateDate'], row['imageID']) if row else None
+
+
+def _session_user(userID):
+    row = _one("SELECT userID, firstname, surname, email, phone, role FROM User WHERE userID = %s", (userID,))
+    return dict(row)
+
+
+def find_fixtures():
+    """Pick the users, category and image the routes are run with."""
+    category = _one("""
+        SELECT categoryID FROM ImageCategory
+        GROUP BY categoryID ORDER BY COUNT(*) DESC LIMIT 1
+    """)['categoryID']
+    return {
+        'admin': _session_user(_one("SELECT userID FROM Admin LIMIT 1")['userID']),
+        'vendor': _session_user(_one("""
+            SELECT userID FROM Image GROUP BY userID ORDER BY COUNT(*) DESC LIMIT 1
+        """)['userID']),
+        'customer': _session_user(_one("""
+            SELECT c.userID FROM CartImage AS c JOIN User AS u ON u.userID = c.userID
+            WHERE u.role = 'Customer' LIMIT 1
+        """)['userID']),
+        'category': category,
+        'image': _one("""
+            SELECT imageID FROM Image
+            WHERE isDeleted = FALSE AND imageStatus = 'Active'
+            ORDER BY quantity DESC LIMIT 1
+        """)['imageID'],
+        'deep_all': _deep_cursor(),
+        'deep_category': _deep_cursor(category),
+    }
+
+
+def routes(fixtures):
+    # (name, url, who)
+    return [
+        ('index', '/', None),
+        ('gallery_all', '/gallery', None),
+        ('gallery_category', f"/gallery?category={fixtures['category']}", None),
+        ('gallery_all_deep', f"/gallery?after={fixtures['deep_all']}&page={DEEP_PAGE}", None),
+        ('gallery_category_deep',
+         f"/gallery?category={fixtures['category']}&after={fixtures['deep_category']}&page={DEEP_PAGE}", None),
+        ('item_detail', f"/item/{fixtures['image']}", 'customer'),
+        ('search', '/search?q=sunset+mountain', None),
+        ('vendor', '/vendor/', 'vendor'),
+        ('manage', '/manage/', 'admin'),
+        ('checkout', '/checkout/', 'customer'),
+    ]
+
+
+def clear_caches():
+    """Empty the in-process caches, for --cold runs."""
+    for value in vars(project.db).values():
+        if isinstance(value, Cache):
+            value.clear()
+    project.db._cache_versions.clear()
+    if fragments._fragment_cache is not None:
+        fragments._fragment_cache.clear()
+
+
+def make_client(app, user):
+    client = app.test_client()
+    if user:
+        with client.session_transaction() as session:
+            session['user'] = user
+            session['logged_in'] = True
+    return client
+
+
+def measure(client, url, iterations, warmup, cold):
+    latencies, queries, statuses = [], [], set()
+    for i in range(warmup + iterations):
+        if cold:
+            clear_caches()
+        started = time.perf_counter()
+        response = client.get(url)
+        elapsed = time.perf_counter() - started
+        if i < warmup:
+            continue
+        latencies.append(elapsed * 1000)
+        statuses.add(response.status_code)
+        match = SERVER_TIMING.search(response.headers.get('Server-Timing', ''))
+        queries.append(int(match.group(2)) if match else 0)
+    latencies = np.array(latencies)
+    return {
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+        'mean_ms': round(float(latencies.mean()), 3),
+        'queries_p50': int(np.percentile(queries, 50)),
+        'queries_max': int(max(queries)),
+        'status': sorted(statuses),
+    }
+
+
+def dataset_size():
+    return {table: _one(f"SELECT COUNT(*) AS n FROM {table}")['n']
+            for table in ('User', 'Image', 'Rating', 'Purchase', 'PurchaseImage', 'Category')}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results, baseline=None):
+    header = f"{'route':<24}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}"
+    if baseline:
+        header += f"{'p95 vs base':>13}{'queries vs base':>17}"
+    print(header)
+    for name, result in results.items():
+        line = (f"{name:<24}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+                f"{result['p99_ms']:>10.2f}{result['queries_p50']:>9}")
+        base = (baseline or {}).get(name)
+        if base:
+            change = (result['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100 if base['p95_ms'] else 0.0
+            line += f"{change:>+12.1f}%{result['queries_p50'] - base['queries_p50']:>+17d}"
+        if result['status'] != [200]:
+            line += f"  status {result['status']}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='database to use (default: MYSQL_DB of create_app)')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--cold', action='store_true', help='clear in-process caches before each request')
+    parser.add_argument('--only', nargs='*', help='route names to run')
+    parser.add_argument('--replica', action='append', default=[], metavar='HOST:PORT',
+                        help='read replica to send read-only queries to (repeatable)')
+    parser.add_argument('--save', metavar='NAME', help=f'write the results to {BASELINE_FOLDER}/NAME.json')
+    parser.add_argument('--compare', metavar='FILE', help='baseline JSON to compare with')
+    args = parser.parse_args()
+
+    # no background workers or session writes in the measurements
+    replicas = [{'host': host, 'port': int(port)} for host, port in
+                (replica.rsplit(':', 1) for replica in args.replica)]
+    app = make_app(args.db, JOB_WORKERS=0, SESSION_BACKEND='memory', WTF_CSRF_ENABLED=False,
+                   MYSQL_REPLICAS=replicas)
+    sessions.init_app(app)
+
+    with app.app_context():
+        fixtures = find_fixtures()
+        size = dataset_size()
+
+    results = {}
+    for name, url, who in routes(fixtures):
+        if args.only and name not in args.only:
+            continue
+        client = make_client(app, fixtures[who] if who else None)
+        results[name] = measure(client, url, args.iterations, args.warmup, args.cold)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['routes']
+    print_report(results, baseline)
+
+    if args.save:
+        os.makedirs(BASELINE_FOLDER, exist_ok=True)
+        path = os.path.join(BASELINE_FOLDER, f'{args.save}.json')
+        with open(path, 'w') as f:
+            json.dump({
+                'meta': {
+                    'commit': git_commit(),
+                    'created': datetime.now().isoformat(timespec='seconds'),
+                    'python': platform.python_version(),
+                    'iterations': args.iterations,
+                    'warmup': args.warmup,
+                    'cold': args.cold,
+                    'dataset': size,
+                },
+                'routes': results,
+            }, f, indent=2, sort_keys=True)
+        print(f'Saved {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""Seed a deterministic synthetic catalog for the benchmarks.
+
+Load project/database.sql into an empty database first, then:
+
+    python -m benchmarks.seed --scale small --db photosite_bench
+
+The same scale always produces the same rows. IDs come from make_id(), and
+the other values come from a seeded random generator or from the row number.
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+from hashlib import sha256
+
+from benchmarks.common import BENCH_PASSWORD, make_app, make_id
+from project import db, mysql
+
+SCALES = {
+    'tiny':   dict(vendors=5, customers=100, categories=10, images=1000,
+                   ratings=5000, purchases=2000, carts=50),
+    'small':  dict(vendors=20, customers=1000, categories=20, images=10000,
+                   ratings=50000, purchases=20000, carts=200),
+    'medium': dict(vendors=200, customers=20000, categories=50, images=100000,
+                   ratings=1000000, purchases=500000, carts=1000),
+    'large':  dict(vendors=1000, customers=200000, categories=100, images=1000000,
+                   ratings=10000000, purchases=5000000, carts=5000),
+}
+
+CHUNK_SIZE = 5000
+# spreads each customer's ratings over distinct images (prime, so no repeats)
+RATING_STRIDE = 104729
+CURRENCIES = ('USD', 'USD', 'AUD', 'EUR')
+WORDS = ('sunset', 'mountain', 'ocean', 'city', 'forest', 'portrait', 'street', 'night',
+         'river', 'desert', 'winter', 'autumn', 'flower', 'bridge', 'harbour', 'storm',
+         'market', 'temple', 'lake', 'canyon', 'skyline', 'beach', 'garden', 'island')
+START_DAY = date(2023, 1, 1)
+DAYS = 1000
+
+
+def image_price(number: int):
+    return round(1.99 + (number * 7919 % 4800) / 100, 2)
+
+
+def image_currency(number: int):
+    return CURRENCIES[number % len(CURRENCIES)]
+
+
+def purchase_images(number: int, numImages: int):
+    # 1-3 consecutive images, from the row number so nothing has to be kept in memory
+    first = number * 2654435761 % numImages
+    return [(first + i) % numImages for i in range(1 + number % 3)]
+
+
+def insert_rows(cur, table, columns, rows, label, total):
+    """Insert rows in CHUNK_SIZE multi-row INSERTs, committing after each chunk."""
+    query = "INSERT INTO {} ({}) VALUES ({})".format(
+        table, ', '.join(columns), ', '.join(['%s'] * len(columns)))
+    done = 0
+    started = time.monotonic()
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            cur.executemany(query, chunk)
+            mysql.connection.commit()
+            done += len(chunk)
+            chunk = []
+            print(f'\r{label}: {done}/{total}', end='', flush=True)
+    if chunk:
+        cur.executemany(query, chunk)
+        mysql.connection.commit()
+        done += len(chunk)
+    print(f'\r{label}: {done}/{total} in {time.monotonic() - started:.1f}s')
+
+
+def seed(scale):
+    rng = random.Random(582)
+    password = sha256(BENCH_PASSWORD.encode()).hexdigest()
+    V, C, K, N = scale['vendors'], scale['customers'], scale['categories'], scale['images']
+
+    if scale['ratings'] > C * N or N % RATING_STRIDE == 0:
+        raise SystemExit('At most one rating per customer and image: change --ratings or --images')
+
+    cur = mysql.connection.cursor()
+    cur.execute("SELECT 1 FROM User WHERE username = 'bench_admin'")
+    if cur.fetchone():
+        raise SystemExit('Benchmark data is already loaded; recreate the database from database.sql first')
+    # rows are generated consistently, so skip the per-row checks while loading
+    cur.execute("SET unique_checks = 0, foreign_key_checks = 0")
+
+    def users():
+        yield (make_id('admin', 0), 'bench_admin', password, 'admin@bench.test', 'Bench', 'Admin', '', 'Admin')
+        for n in range(V):
+            yield (make_id('vendor', n), f'bench_vendor_{n}', password, f'vendor{n}@bench.test',
+                   'Vendor', str(n), '', 'Vendor')
+        for n in range(C):
+            yield (make_id('customer', n), f'bench_customer_{n}', password, f'customer{n}@bench.test',
+                   'Customer', str(n), '', 'Customer')
+
+    insert_rows(cur, 'User', ('userID', 'username', 'password', 'email', 'firstname', 'surname', 'phone', 'role'),
+                users(), 'users', 1 + V + C)
+    insert_rows(cur, 'Admin', ('userID',), [(make_id('admin', 0),)], 'admins', 1)
+    insert_rows(cur, 'Customer', ('userID', 'customerRank'),
+                ((make_id(kind, n), 'Bronze') for kind, count in (('vendor', V), ('customer', C))
+                 for n in range(count)), 'customers', V + C)
+    insert_rows(cur, 'Vendor', ('userID', 'bio', 'portfolio'),
+                ((make_id('vendor', n), f'Synthetic vendor {n}', '') for n in range(V)), 'vendors', V)
+    insert_rows(cur, 'Category', ('categoryID', 'categoryName', 'description'),
+                ((make_id('category', n), f'Bench {WORDS[n % len(WORDS)].title()} {n}', '') for n in range(K)),
+                'categories', K)
+
+    def images():
+        for n in range(N):
+            words = rng.sample(WORDS, 3)
+            yield (make_id('image', n), make_id('vendor', n % V), ' '.join(words).title() + f' {n}',
+                   'A synthetic photo of ' + ', '.join(rng.sample(WORDS, 5)), image_price(n),
+                   image_currency(n), START_DAY + timedelta(days=rng.randrange(DAYS)),
+                   'Draft' if rng.random() < 0.05 else 'Active', 0, '.jpg')
+
+    insert_rows(cur, 'Image', ('imageID', 'userID', 'title', 'description', 'price', 'currency',
+                               'updateDate', 'imageStatus', 'quantity', 'extension'),
+                images(), 'images', N)
+
+    def image_categories():
+        for n in range(N):
+            yield (make_id('category', n % K), make_id('image', n))
+            second = (n * 31 + 7) % K
+            if second != n % K:
+                yield (make_id('category', second), make_id('image', n))
+
+    insert_rows(cur, 'ImageCategory', ('categoryID', 'imageID'), image_categories(), 'image categories', 2 * N)
+
+    def ratings():
+        for n in range(scale['ratings']):
+            customer, k = n % C, n // C
+            image = (customer * 7919 + k * RATING_STRIDE) % N
+            yield (make_id('rating', n), make_id('customer', customer), make_id('image', image),
+                   rng.randint(1, 5), '', START_DAY + timedelta(days=rng.randrange(DAYS)))
+
+    insert_rows(cur, 'Rating', ('ratingID', 'userID', 'imageID', 'score', 'comment', 'updateDate'),
+                ratings(), 'ratings', scale['ratings'])
+
+    insert_rows(cur, 'Purchase', ('purchaseID', 'userID', 'purchaseDate', 'totalAmount'),
+                ((make_id('purchase', n), make_id('customer', rng.randrange(C)),
+                  START_DAY + timedelta(days=rng.randrange(DAYS)),
+                  round(sum(image_price(image) for image in purchase_images(n, N)), 2))
+                 for n in range(scale['purchases'])),
+                'purchases', scale['purchases'])
+    insert_rows(cur, 'PurchaseImage', ('purchaseID', 'imageID', 'price', 'currency'),
+                ((make_id('purchase', n), make_id('image', image), image_price(image), image_currency(image))
+                 for n in range(scale['purchases']) for image in purchase_images(n, N)),
+                'purchase images', 2 * scale['purchases'])
+    insert_rows(cur, 'CartImage', ('userID', 'imageID'),
+                ((make_id('customer', n), make_id('image', (n * 3 + i) % N))
+                 for n in range(min(scale['carts'], C)) for i in range(3)),
+                'cart images', 3 * min(scale['carts'], C))
+
+    cur.execute("SET unique_checks = 1, foreign_key_checks = 1")
+    print('Updating sales counters...')
+    cur.execute("""
+        UPDATE Image AS i
+        JOIN (SELECT imageID, COUNT(*) AS sold FROM PurchaseImage GROUP BY imageID) AS s
+          ON s.imageID = i.imageID
+        SET i.quantity = s.sold
+    """)
+    mysql.connection.commit()
+    cur.close()
+
+    # derived tables, built the same way as the maintenance commands do
+    print('Rebuilding rating summaries...')
+    db.rebuild_rating_summaries()
+    print('Rebuilding sales rollups...')
+    db.rebuild_sales_rollups()
+    print('Recomputing customer ranks...')
+    db.recompute_customer_ranks()
+    print('Rebuilding category order...')
+    db.rebuild_image_category_order()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--db', help='database to seed (default: MYSQL_DB of create_app)')
+    for name in SCALES['small']:
+        parser.add_argument(f'--{name}', type=int, help=f'override the number of {name}')
+    args = parser.parse_args()
+
+    scale = dict(SCALES[args.scale])
+    scale.update({name: getattr(args, name) for name in scale if getattr(args, name) is not None})
+    print('Seeding', ', '.join(f'{value} {name}' for name, value in scale.items()))
+
+    app = make_app(args.db, JOB_WORKERS=0)
+    started = time.monotonic()
+    with app.app_context():
+        seed(scale)
+    print(f'Done in {time.monotonic() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 #import flask - from package import class
 from flask import Flask, render_template, session
 from flask_bootstrap import Bootstrap5
-from flask_mysqldb import MySQL
+from project.pool import MySQL
 
 mysql = MySQL()
 
@@ -17,12 +17,62 @@ def create_app():
     app.config['MYSQL_DB'] = 'photosite'
     app.config['MYSQL_HOST'] = 'localhost'
     app.config['MYSQL_CURSORCLASS'] = 'DictCursor'
+    # connection pool: size it below MySQL max_connections / number of workers
+    app.config['MYSQL_POOL_SIZE'] = 10
+    app.config['MYSQL_POOL_TIMEOUT'] = 10.0    # seconds to wait for a free connection
+    app.config['MYSQL_POOL_RECYCLE'] = 3600    # close connections older than this
+    app.config['MYSQL_POOL_PRE_PING'] = True
+    # read replicas for read-only queries, e.g. [{'host': '127.0.0.1', 'port': 3307}];
+    # a session's reads stay on the primary this many seconds after it writes
+    app.config['MYSQL_REPLICAS'] = []
+    app.config['MYSQL_READ_YOUR_WRITES_SECONDS'] = 10
     #configuration the upload folder for photos
     UPLOAD_FOLDER = 'project/static/img/'
     app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    # largest accepted image upload; requests bigger than MAX_CONTENT_LENGTH
+    # are rejected with 413 before the body is read
+    app.config['UPLOAD_MAX_BYTES'] = 25 * 1024 * 1024
+    app.config['MAX_CONTENT_LENGTH'] = app.config['UPLOAD_MAX_BYTES'] + 1024 * 1024
+    # number of background processes used to build thumbnails/derivatives
+    app.config['DERIVATIVE_WORKERS'] = 2
+    # set to the internal nginx location (e.g. '/protected-img/') to let the
+    # proxy send image files via X-Accel-Redirect; USE_X_SENDFILE works for Apache
+    app.config['MEDIA_ACCEL_REDIRECT'] = None
+    # rendered gallery card grids kept in memory (bytes) and how long (seconds)
+    app.config['GALLERY_FRAGMENT_CACHE_BYTES'] = 8 * 1024 * 1024
+    app.config['GALLERY_FRAGMENT_TTL'] = 600
+    # background job threads per process (0 = only `flask run-jobs` processes jobs)
+    app.config['JOB_WORKERS'] = 2
+    app.config['JOB_MAX_ATTEMPTS'] = 5
+    # sessions are kept server side ('mysql' or 'memory'; 'cookie' = Flask's
+    # signed cookie); each process caches them for SESSION_LOCAL_CACHE_TTL seconds
+    app.config['SESSION_BACKEND'] = 'mysql'
+    app.config['SESSION_LOCAL_CACHE_TTL'] = 5.0
+    # requests running this many statements of the same shape are logged as N+1;
+    # set METRICS_TOKEN to require 'Authorization: Bearer <token>' on /metrics
+    app.config['N_PLUS_ONE_THRESHOLD'] = 10
+    app.config['METRICS_TOKEN'] = None
+    # customer ranks by lifetime spend, in RANK_BASE_CURRENCY
+    # (CURRENCY_RATES converts each currency into it)
+    app.config['RANK_BASE_CURRENCY'] = 'USD'
+    app.config['CURRENCY_RATES'] = {'USD': 1.0, 'EUR': 1.08, 'AUD': 0.66}
+    app.config['RANK_THRESHOLDS'] = {'Silver': 100, 'Gold': 500}
     
     mysql.init_app(app)
     Bootstrap5(app)
+
+    from . import metrics
+    metrics.init_app(app)
+
+    from . import sessions
+    sessions.init_app(app)
+
+    from . import jobs
+    jobs.init_app(app)
+    from . import thumbnails
+    thumbnails.init_app(app)
+    from . import commands
+    commands.init_app(app)
     
     #importing modules here to avoid circular references, register blueprints of routes
     from . import views
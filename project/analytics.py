@@ -0,0 +1,103 @@
+from datetime import date, timedelta
+
+import numpy as np
+from flask import current_app
+
+from project import db
+
+# trailing windows compared on the dashboard, in days
+ANALYTICS_WINDOWS = (7, 30)
+ANALYTICS_MAX_DAYS = 366
+TOP_IMAGES = 10
+
+
+def rolling_sum(values, window: int):
+    """Trailing window sums of a daily series; the first days use what is available."""
+    totals = np.concatenate(([0], np.cumsum(values)))
+    ends = np.arange(1, len(values) + 1)
+    return totals[ends] - totals[np.maximum(ends - window, 0)]
+
+
+def _window_summary(revenue, units, window: int):
+    current = revenue[-window:].sum()
+    previous = revenue[-2 * window:-window].sum() if len(revenue) > window else 0.0
+    return {
+        'days': window,
+        'revenue': round(float(current), 2),
+        'units': int(units[-window:].sum()),
+        'previousRevenue': round(float(previous), 2),
+        # percentage change against the window before it
+        'change': round(float((current - previous) / previous * 100), 1) if previous else None,
+    }
+
+
+def _top_images(imageRows, rates):
+    images = {}
+    for row in imageRows:
+        image = images.setdefault(row['imageID'], {
+            'imageID': row['imageID'], 'title': row['title'], 'revenue': 0.0, 'units': 0})
+        image['revenue'] += float(row['revenue']) * rates[row['currency']]
+        image['units'] += int(row['units'])
+    ranked = sorted(images.values(), key=lambda image: (-image['revenue'], -image['units']))
+    for image in ranked:
+        image['revenue'] = round(image['revenue'], 2)
+    return ranked[:TOP_IMAGES]
+
+
+def build_vendor_report(dailyRows, imageRows, start: date, end: date, historyStart: date = None):
+    """Turn rollup rows into dense daily series and windowed aggregates.
+
+    dailyRows may start earlier (historyStart) so the trailing windows are
+    complete on the first reported day. Revenue is converted into
+    RANK_BASE_CURRENCY with CURRENCY_RATES; per-currency totals are kept too.
+    """
+    rates = current_app.config['CURRENCY_RATES']
+    historyStart = min(historyStart or start, start)
+    days = np.arange(np.datetime64(historyStart, 'D'), np.datetime64(end, 'D') + 1)
+    numReported = (end - start).days + 1  # the last numReported days are in the report
+    revenue = np.zeros(len(days))
+    units = np.zeros(len(days), dtype=np.int64)
+    byCurrency = {}
+    reported = np.zeros(len(days), dtype=bool)
+    reported[-numReported:] = True
+    if dailyRows:
+        index = (np.array([row['day'] for row in dailyRows], dtype='datetime64[D]') - days[0]).astype(np.int64)
+        amounts = np.array([float(row['revenue']) for row in dailyRows])
+        currencies = np.array([row['currency'] for row in dailyRows])
+        np.add.at(revenue, index, amounts * np.array([rates[c] for c in currencies]))
+        np.add.at(units, index, np.array([int(row['units']) for row in dailyRows]))
+        inPeriod = reported[index]
+        for currency in np.unique(currencies[inPeriod]):
+            byCurrency[str(currency)] = round(
+                float(amounts[inPeriod & (currencies == currency)].sum()), 2)
+
+    rolling = {window: rolling_sum(revenue, window) for window in ANALYTICS_WINDOWS}
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'currency': current_app.config['RANK_BASE_CURRENCY'],
+        'totals': {
+            'revenue': round(float(revenue[reported].sum()), 2),
+            'units': int(units[reported].sum()),
+            'byCurrency': byCurrency,
+        },
+        'windows': [_window_summary(revenue, units, window) for window in ANALYTICS_WINDOWS],
+        'daily': [{
+            'day': str(day),
+            'revenue': round(float(revenue[i]), 2),
+            'units': int(units[i]),
+            **{f'revenue{window}d': round(float(rolling[window][i]), 2) for window in ANALYTICS_WINDOWS},
+        } for i, day in enumerate(days) if reported[i]],
+        'topImages': _top_images(imageRows, rates),
+    }
+
+
+def get_vendor_report(userID: str, numDays: int):
+    numDays = max(1, min(numDays, ANALYTICS_MAX_DAYS))
+    end = date.today()
+    start = end - timedelta(days=numDays - 1)
+    # windows are compared with the window before them, so read that far back
+    historyStart = min(start, end - timedelta(days=2 * max(ANALYTICS_WINDOWS) - 1))
+    return build_vendor_report(db.get_vendor_daily_sales(userID, historyStart, end),
+                               db.get_vendor_image_sales(userID, start, end),
+                               start, end, historyStart)
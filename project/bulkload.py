@@ -0,0 +1,310 @@
+"""Bulk import of categories, users, vendors, images and purchases.
+
+Input files are CSV (with a header row) or JSON Lines, optionally gzipped.
+Records are written in chunks of multi-row INSERTs, one transaction per
+chunk, and a checkpoint file records how far each file got so an
+interrupted import resumes after the last committed chunk.
+"""
+import csv
+import gzip
+import json
+import os
+import time
+import uuid
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from hashlib import sha256
+
+import click
+import MySQLdb
+
+from project import db
+from project.models import Currency, ImageStatus, Role
+
+# referenced tables first, so foreign keys always resolve
+IMPORT_ORDER = ('categories', 'users', 'vendors', 'images', 'purchases')
+CHUNK_SIZE = 5000
+# IDs left out of the input are derived from the username / category name
+IMPORT_NAMESPACE = uuid.UUID('2f0f4a52-5d7e-4f43-8c55-7a1f3c9e2b61')
+
+USER_COLUMNS = ('userID', 'username', 'password', 'email', 'firstname', 'surname', 'phone', 'role', 'isDeleted')
+IMAGE_COLUMNS = ('imageID', 'userID', 'title', 'description', 'price', 'currency', 'updateDate',
+                 'imageStatus', 'extension', 'isDeleted')
+
+
+class BulkImportError(ValueError):
+    pass
+
+
+def derived_id(kind: str, name: str):
+    return str(uuid.uuid5(IMPORT_NAMESPACE, f'{kind}:{name}'))
+
+
+def open_records(path):
+    """Return an iterator over the records of a .csv or .jsonl file (optionally .gz)."""
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith('.csv'):
+        return _read_records(path, isCsv=True)
+    if name.endswith(('.jsonl', '.ndjson')):
+        return _read_records(path, isCsv=False)
+    raise BulkImportError('expected a .csv or .jsonl file')
+
+
+def _read_records(path, isCsv):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', newline='') as f:
+        if isCsv:
+            yield from csv.DictReader(f)
+            return
+        for lineNumber, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise BulkImportError(f'line {lineNumber}: {e}')
+
+
+def _value(record, field, default=None):
+    # empty CSV cells count as missing
+    value = record.get(field)
+    return default if value is None or value == '' else value
+
+
+def _required(record, field, number):
+    value = _value(record, field)
+    if value is None:
+        raise BulkImportError(f'record {number}: {field} is required')
+    return value
+
+
+def _choice(record, field, enum, default, number):
+    value = _value(record, field, default)
+    if value not in {member.value for member in enum}:
+        raise BulkImportError(f'record {number}: invalid {field} {value!r}')
+    return value
+
+
+def _decimal(value, field, number):
+    try:
+        return Decimal(str(value)).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise BulkImportError(f'record {number}: invalid {field} {value!r}')
+
+
+def _flag(value):
+    return str(value).strip().lower() in ('1', 'true', 'yes')
+
+
+def _list(value):
+    # JSON arrays, or ';'-separated CSV cells
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [item.strip() for item in str(value).split(';') if item.strip()]
+
+
+def category_batches(records, options):
+    categories = []
+    for number, record in records:
+        name = _required(record, 'categoryName', number)
+        categories.append((_value(record, 'categoryID') or derived_id('category', name), name,
+                           _value(record, 'description', '')))
+    return [('Category', ('categoryID', 'categoryName', 'description'), ('categoryID',), categories)]
+
+
+def user_batches(records, options, role=None):
+    users, admins, customers, vendors = [], [], [], []
+    for number, record in records:
+        username = _required(record, 'username', number)
+        userID = _value(record, 'userID') or derived_id('user', username)
+        userRole = role or _choice(record, 'role', Role, Role.CUSTOMER.value, number)
+        password = _required(record, 'password', number)
+        if options['hash_passwords']:
+            password = sha256(password.encode()).hexdigest()
+        users.append((userID, username, password, _value(record, 'email'), _value(record, 'firstname'),
+                      _value(record, 'surname'), _value(record, 'phone'), userRole,
+                      _flag(_value(record, 'isDeleted', False))))
+        if userRole == Role.ADMIN.value:
+            admins.append((userID,))
+            continue
+        # vendors are customers too; rank and spend are recomputed after the import
+        customers.append((userID,))
+        if userRole == Role.VENDOR.value:
+            vendors.append((userID, _value(record, 'bio', ''), _value(record, 'portfolio', '')))
+    return [
+        ('User', USER_COLUMNS, ('userID',), users),
+        ('Admin', ('userID',), ('userID',), admins),
+        ('Customer', ('userID',), ('userID',), customers),
+        ('Vendor', ('userID', 'bio', 'portfolio'), ('userID',), vendors),
+    ]
+
+
+def vendor_batches(records, options):
+    return user_batches(records, options, role=Role.VENDOR.value)
+
+
+def image_batches(records, options):
+    images, imageCategories = [], []
+    for number, record in records:
+        imageID = _required(record, 'imageID', number)
+        images.append((imageID, _required(record, 'userID', number), _required(record, 'title', number),
+                       _value(record, 'description', ''),
+                       _decimal(_required(record, 'price', number), 'price', number),
+                       _choice(record, 'currency', Currency, Currency.USD.value, number),
+                       _value(record, 'updateDate', date.today()),
+                       _choice(record, 'imageStatus', ImageStatus, ImageStatus.ACTIVE.value, number),
+                       _required(record, 'extension', number),
+                       _flag(_value(record, 'isDeleted', False))))
+        imageCategories += [(categoryID, imageID) for categoryID in _list(record.get('categoryIDs'))]
+    return [
+        ('Image', IMAGE_COLUMNS, ('imageID',), images),
+        ('ImageCategory', ('categoryID', 'imageID'), ('categoryID', 'imageID'), imageCategories),
+    ]
+
+
+def _purchase_items(record, number):
+    # items: ["imageID", ...] or [{"imageID", "price", "currency"}, ...];
+    # in CSV "imageID[:price[:currency]];..."
+    items = []
+    for item in _list(record.get('items')):
+        if isinstance(item, str):
+            item = dict(zip(('imageID', 'price', 'currency'), item.split(':')))
+        items.append((_required(item, 'imageID', number), _value(item, 'price'), _value(item, 'currency')))
+    if not items:
+        raise BulkImportError(f'record {number}: a purchase needs at least one item')
+    return items
+
+
+def purchase_batches(records, options):
+    parsed = [(number, record, _purchase_items(record, number)) for number, record in records]
+    # price paid defaults to the image's current price, looked up once per chunk
+    missing = {imageID for _, _, items in parsed for imageID, price, _ in items if price is None}
+    prices = db.get_image_prices(sorted(missing))
+
+    purchases, purchaseImages = [], []
+    for number, record, items in parsed:
+        purchaseID = _required(record, 'purchaseID', number)
+        total = Decimal('0.00')
+        for imageID, price, currency in items:
+            if price is None:
+                if imageID not in prices:
+                    raise BulkImportError(f'record {number}: unknown image {imageID}')
+                price, currency = prices[imageID][0], currency or prices[imageID][1]
+            price = _decimal(price, 'price', number)
+            currency = _choice({'currency': currency}, 'currency', Currency, Currency.USD.value, number)
+            purchaseImages.append((purchaseID, imageID, price, currency))
+            total += price
+        totalAmount = _value(record, 'totalAmount')
+        purchases.append((purchaseID, _required(record, 'userID', number),
+                          _value(record, 'purchaseDate', date.today()),
+                          total if totalAmount is None else _decimal(totalAmount, 'totalAmount', number)))
+    return [
+        ('Purchase', ('purchaseID', 'userID', 'purchaseDate', 'totalAmount'), ('purchaseID',), purchases),
+        ('PurchaseImage', ('purchaseID', 'imageID', 'price', 'currency'), ('purchaseID', 'imageID'),
+         purchaseImages),
+    ]
+
+
+CONVERTERS = {
+    'categories': category_batches,
+    'users': user_batches,
+    'vendors': vendor_batches,
+    'images': image_batches,
+    'purchases': purchase_batches,
+}
+
+
+class Checkpoint:
+    """Records per input file how many records are committed, in a JSON file."""
+
+    def __init__(self, path, restart=False):
+        self.path = path
+        self.state = {}
+        if path and not restart and os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+
+    def start(self, name, source):
+        """Number of records of `source` already imported."""
+        entry = self.state.get(name)
+        size = os.path.getsize(source)
+        if entry and (entry['file'] != os.path.abspath(source) or entry['size'] != size):
+            raise click.ClickException(
+                f'{source} differs from the checkpointed {name} file; use --restart to import it again')
+        if not entry:
+            entry = self.state[name] = {'file': os.path.abspath(source), 'size': size,
+                                        'records': 0, 'done': False}
+        return entry
+
+    def save(self):
+        if not self.path:
+            return
+        # write then rename, so a crash never leaves a truncated checkpoint
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def _chunks(records, size, skip):
+    chunk = []
+    for number, record in enumerate(records, 1):
+        if number <= skip:
+            continue
+        chunk.append((number, record))
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_file(name, source, checkpoint, options):
+    entry = checkpoint.start(name, source)
+    if entry['done']:
+        click.echo(f'{name}: already imported from {source}, skipping')
+        return 0
+    if entry['records']:
+        click.echo(f'{name}: resuming after record {entry["records"]}')
+
+    convert = CONVERTERS[name]
+    started = time.monotonic()
+    imported = 0
+    try:
+        for chunk in _chunks(open_records(source), options['chunk_size'], entry['records']):
+            try:
+                db.bulk_insert(convert(chunk, options))
+            except MySQLdb.Error as e:
+                raise click.ClickException(
+                    f'{source}: records {chunk[0][0]}-{chunk[-1][0]} were not imported: {e}')
+            imported += len(chunk)
+            entry['records'] = chunk[-1][0]
+            checkpoint.save()
+            rate = imported / max(time.monotonic() - started, 1e-6)
+            click.echo(f'\r{name}: {entry["records"]} records ({rate:.0f}/s)', nl=False)
+    except BulkImportError as e:
+        raise click.ClickException(f'{source}: {e}')
+    entry['done'] = True
+    checkpoint.save()
+    click.echo(f'\r{name}: {entry["records"]} records in {time.monotonic() - started:.1f}s')
+    return imported
+
+
+def run_import(files, checkpointPath, restart=False, chunk_size=CHUNK_SIZE, hash_passwords=False):
+    """Import {dataset: path} in IMPORT_ORDER, then refresh the derived tables."""
+    checkpoint = Checkpoint(checkpointPath, restart)
+    options = {'chunk_size': chunk_size, 'hash_passwords': hash_passwords}
+    for name in IMPORT_ORDER:
+        if files.get(name):
+            import_file(name, files[name], checkpoint, options)
+
+    purchases = bool(files.get('purchases'))
+    db.finish_bulk_import(purchases)
+    if purchases:
+        click.echo('Rebuilding sales rollups and customer ranks...')
+        db.rebuild_sales_rollups()
+        db.recompute_customer_ranks()
+    # the checkpoint only matters while an import is unfinished
+    if checkpointPath and os.path.exists(checkpointPath):
+        os.remove(checkpointPath)
@@ -0,0 +1,102 @@
+import click
+
+from project import bulkload, db, uploads
+
+
+def init_app(app):
+    """Register the database maintenance commands on the flask CLI."""
+
+    @app.cli.command('rebuild-rating-summary')
+    def rebuild_rating_summary():
+        """Recompute RatingSummary from the Rating table."""
+        count = db.rebuild_rating_summaries()
+        click.echo(f'Rebuilt rating summaries for {count} image(s)')
+
+    @app.cli.command('check-rating-summary')
+    def check_rating_summary():
+        """List images whose RatingSummary does not match their ratings."""
+        mismatched = db.check_rating_summaries()
+        for imageID in mismatched:
+            click.echo(imageID)
+        if mismatched:
+            click.echo(f'{len(mismatched)} inconsistent summary(ies), run rebuild-rating-summary', err=True)
+            raise SystemExit(1)
+        click.echo('Rating summaries are consistent')
+
+    @app.cli.command('rebuild-sales-rollups')
+    def rebuild_sales_rollups():
+        """Recompute the daily vendor/image sales rollups from all purchases."""
+        count = db.rebuild_sales_rollups()
+        click.echo(f'Rebuilt {count} vendor sales day(s)')
+
+    @app.cli.command('rebuild-category-order')
+    def rebuild_category_order():
+        """Recopy image dates and visibility onto the ImageCategory rows."""
+        count = db.rebuild_image_category_order()
+        click.echo(f'Updated {count} image category row(s)')
+
+    @app.cli.command('recompute-ranks')
+    def recompute_ranks():
+        """Recompute customer spend and ranks from all purchases."""
+        count = db.recompute_customer_ranks()
+        click.echo(f'Updated {count} customer(s)')
+
+    @app.cli.command('purge-sessions')
+    def purge_sessions():
+        """Delete expired server-side sessions from the Session table."""
+        count = db.purge_sessions()
+        click.echo(f'Deleted {count} expired session(s)')
+
+    @app.cli.command('purge-jobs')
+    @click.option('--days', type=int, default=7, show_default=True,
+                  help='Delete finished jobs older than this many days.')
+    def purge_jobs(days):
+        """Delete finished background jobs from the Job table."""
+        count = db.purge_jobs(days)
+        click.echo(f'Deleted {count} finished job(s)')
+
+    @app.cli.command('purge-blobs')
+    @click.option('--min-age-hours', type=float, default=24, show_default=True,
+                  help='Keep blobs written or reused more recently than this.')
+    def purge_blobs(min_age_hours):
+        """Delete stored upload files that no image references."""
+        minAge = min_age_hours * 3600
+        folder = app.config['UPLOAD_FOLDER']
+        removed = 0
+        for sha256 in db.purge_unreferenced_blobs(int(minAge)):
+            removed += uploads.purge_blob_file(uploads.blob_path(folder, sha256), minAge)
+        # files of uploads that failed before their ImageBlob row was written
+        batch = []
+        for item in uploads.iter_blob_files(folder):
+            batch.append(item)
+            if len(batch) == 1000:
+                removed += _purge_unknown_blob_files(batch, minAge)
+                batch = []
+        removed += _purge_unknown_blob_files(batch, minAge)
+        removed += uploads.purge_tmp_files(folder, minAge)
+        click.echo(f'Removed {removed} unreferenced blob file(s)')
+
+    @app.cli.command('import-data')
+    @click.option('--categories', type=click.Path(exists=True, dir_okay=False), help='Categories file.')
+    @click.option('--users', type=click.Path(exists=True, dir_okay=False), help='Users file (any role).')
+    @click.option('--vendors', type=click.Path(exists=True, dir_okay=False), help='Vendors file.')
+    @click.option('--images', type=click.Path(exists=True, dir_okay=False), help='Images file.')
+    @click.option('--purchases', type=click.Path(exists=True, dir_okay=False), help='Purchases file.')
+    @click.option('--checkpoint', default='import-checkpoint.json', show_default=True,
+                  help='Progress file used to resume an interrupted import.')
+    @click.option('--restart', is_flag=True, help='Ignore the checkpoint and start from the beginning.')
+    @click.option('--chunk-size', type=click.IntRange(1), default=bulkload.CHUNK_SIZE, show_default=True,
+                  help='Records per transaction.')
+    @click.option('--hash-passwords', is_flag=True, help='Passwords in the files are plain text; hash them.')
+    def import_data(checkpoint, restart, chunk_size, hash_passwords, **files):
+        """Bulk import CSV or JSONL files (optionally .gz) in foreign key order."""
+        if not any(files.values()):
+            raise click.UsageError('Give at least one file to import')
+        bulkload.run_import(files, checkpoint, restart=restart, chunk_size=chunk_size,
+                            hash_passwords=hash_passwords)
+        click.echo('Import finished')
+
+
+def _purge_unknown_blob_files(batch, minAge):
+    known = db.get_known_blobs([sha256 for sha256, _ in batch])
+    return sum(uploads.purge_blob_file(path, minAge) for sha256, path in batch if sha256 not in known)
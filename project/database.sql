@@ -6,10 +6,17 @@ USE photosite;
 DROP TABLE IF EXISTS PurchaseImage;
 DROP TABLE IF EXISTS ImageCategory;
 DROP TABLE IF EXISTS CartImage;
+DROP TABLE IF EXISTS ImageSalesDaily;
+DROP TABLE IF EXISTS VendorSalesDaily;
+DROP TABLE IF EXISTS RatingSummary;
 DROP TABLE IF EXISTS Rating;
 DROP TABLE IF EXISTS Purchase;
 DROP TABLE IF EXISTS Image;
+DROP TABLE IF EXISTS ImageBlob;
 DROP TABLE IF EXISTS Category;
+DROP TABLE IF EXISTS CacheVersion;
+DROP TABLE IF EXISTS Job;
+DROP TABLE IF EXISTS Session;
 DROP TABLE IF EXISTS Vendor;
 DROP TABLE IF EXISTS Customer;
 DROP TABLE IF EXISTS Admin;
@@ -29,7 +36,13 @@ CREATE TABLE User (
   phone     VARCHAR(20),
   role      ENUM('Admin','Customer','Vendor') NOT NULL DEFAULT 'Customer',
   isDeleted BOOLEAN NOT NULL DEFAULT FALSE,
-  PRIMARY KEY (userID)
+  PRIMARY KEY (userID),
+  -- admin user directory: keyset pages on username for every filter
+  -- combination, or on (email, username) for email prefix searches
+  KEY idx_user_role_status (role, isDeleted, username),
+  KEY idx_user_role (role, username),
+  KEY idx_user_status (isDeleted, username),
+  KEY idx_user_email (email, username)
 );
 
 
@@ -45,6 +58,7 @@ CREATE TABLE Admin (
 CREATE TABLE Customer (
   userID       CHAR(36) NOT NULL,
   customerRank ENUM('Bronze','Silver','Gold') NOT NULL DEFAULT 'Bronze',
+  totalSpend   DECIMAL(14,2) NOT NULL DEFAULT 0,   -- lifetime spend in RANK_BASE_CURRENCY
   PRIMARY KEY (userID),
   CONSTRAINT fk_customer_user
     FOREIGN KEY (userID) REFERENCES User(userID)
@@ -70,13 +84,73 @@ CREATE TABLE Category (
   categoryID   CHAR(36)     NOT NULL,
   categoryName VARCHAR(50)  NOT NULL UNIQUE,
   description  TEXT,
-  PRIMARY KEY (categoryID)
+  PRIMARY KEY (categoryID),
+  FULLTEXT KEY ft_category_name (categoryName)
+);
+
+-- Version counters for in-process caches (bumped by writers, polled by readers)
+CREATE TABLE CacheVersion (
+  name    VARCHAR(50) NOT NULL,
+  version BIGINT      NOT NULL DEFAULT 0,
+  PRIMARY KEY (name)
+);
+
+INSERT INTO CacheVersion (name, version) VALUES ('categories', 0), ('catalog', 0), ('sales', 0);
+
+-- ======================
+-- SESSIONS / JOBS
+-- ======================
+
+-- server-side sessions (project/sessions.py); the cookie holds only sessionID
+CREATE TABLE Session (
+  sessionID   CHAR(43)      NOT NULL,
+  userID      CHAR(36)      NULL,                   -- logged-in user, for revocation
+  data        MEDIUMTEXT    NOT NULL,
+  expiresAt   DATETIME      NOT NULL,
+  PRIMARY KEY (sessionID),
+  KEY idx_session_user (userID),
+  KEY idx_session_expires (expiresAt)
+);
+
+-- background job queue (project/jobs.py); FOR UPDATE SKIP LOCKED needs MySQL 8.0+
+CREATE TABLE Job (
+  jobID        BIGINT        NOT NULL AUTO_INCREMENT,
+  kind         VARCHAR(64)   NOT NULL,
+  payload      JSON          NOT NULL,
+  dedupeKey    VARCHAR(191)  NULL,
+  status       ENUM('queued','running','done','failed') NOT NULL DEFAULT 'queued',
+  attempts     INT           NOT NULL DEFAULT 0,
+  maxAttempts  INT           NOT NULL DEFAULT 5,
+  runAfter     DATETIME(6)   NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+  lockedBy     VARCHAR(64)   NULL,
+  lockedAt     DATETIME(6)   NULL,
+  lastError    TEXT          NULL,
+  createdAt    DATETIME(6)   NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+  finishedAt   DATETIME(6)   NULL,
+  -- at most one queued/running job per dedupeKey
+  activeKey    VARCHAR(191)  AS (IF(status IN ('queued','running'), dedupeKey, NULL)) STORED,
+  PRIMARY KEY (jobID),
+  UNIQUE KEY uq_job_active (activeKey),
+  KEY idx_job_ready (status, runAfter),
+  KEY idx_job_lease (status, lockedAt)
 );
 
 -- ======================
 -- IMAGE / PURCHASE FLOW
 -- ======================
 
+-- uploaded files stored once per content hash; the Image rows whose blobHash
+-- points here are its references (idx_image_blob), fk_img_blob keeps referenced
+-- rows, and `flask purge-blobs` deletes the rest
+CREATE TABLE ImageBlob (
+  sha256      CHAR(64)      NOT NULL,
+  extension   VARCHAR(10)   NOT NULL,
+  byteSize    BIGINT        NOT NULL,
+  createdAt   TIMESTAMP     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  lastUsedAt  TIMESTAMP     NOT NULL DEFAULT CURRENT_TIMESTAMP,  -- last upload of this content
+  PRIMARY KEY (sha256)
+);
+
 -- Owner is a Vendor (hence FK -> Vendor)
 CREATE TABLE Image (
   imageID     CHAR(36)      NOT NULL,
@@ -90,9 +164,19 @@ CREATE TABLE Image (
   quantity    INT            NOT NULL DEFAULT 0,
   extension   VARCHAR(10)    NOT NULL,
   isDeleted   BOOLEAN NOT NULL DEFAULT FALSE,
+  blobHash    CHAR(64)       NULL,                  -- FK → ImageBlob (NULL for seeded images)
   PRIMARY KEY (imageID),
+  KEY idx_image_blob (blobHash),
+  -- homepage feeds (best sellers / new arrivals)
+  KEY idx_image_sales (isDeleted, imageStatus, quantity, updateDate, imageID),
+  KEY idx_image_recent (isDeleted, imageStatus, updateDate, imageID),
+  -- /search
+  FULLTEXT KEY ft_image_text (title, description),
   CONSTRAINT fk_img_vendor
     FOREIGN KEY (userID) REFERENCES Vendor(userID)
+    ON UPDATE CASCADE ON DELETE RESTRICT,
+  CONSTRAINT fk_img_blob
+    FOREIGN KEY (blobHash) REFERENCES ImageBlob(sha256)
     ON UPDATE CASCADE ON DELETE RESTRICT
 );
 
@@ -101,8 +185,10 @@ CREATE TABLE Purchase (
   purchaseID   CHAR(36)      NOT NULL,
   userID       CHAR(36)      NOT NULL,               -- FK → Customer
   purchaseDate DATE,
-  totalAmount  DECIMAL(12,2) NOT NULL,
+  totalAmount  DECIMAL(12,2) NOT NULL,               -- in RANK_BASE_CURRENCY
+  checkoutToken CHAR(36)    NULL,                   -- idempotency key of the checkout form
   PRIMARY KEY (purchaseID),
+  UNIQUE KEY uq_purchase_token (checkoutToken),
   CONSTRAINT fk_purchase_customer
     FOREIGN KEY (userID) REFERENCES Customer(userID)
     ON UPDATE CASCADE ON DELETE RESTRICT
@@ -111,6 +197,8 @@ CREATE TABLE Purchase (
 CREATE TABLE PurchaseImage (
   purchaseID CHAR(36) NOT NULL,
   imageID    CHAR(36) NOT NULL,
+  price      DECIMAL(12,2) NOT NULL DEFAULT 0,     -- price paid, in currency
+  currency   ENUM('USD','EUR','AUD') NOT NULL DEFAULT 'USD',
   PRIMARY KEY (purchaseID, imageID),
   CONSTRAINT fk_pi_purchase
     FOREIGN KEY (purchaseID) REFERENCES Purchase(purchaseID)
@@ -150,11 +238,62 @@ CREATE TABLE Rating (
     ON UPDATE CASCADE ON DELETE CASCADE
 );
 
+-- Daily sales rollups for vendor analytics, maintained by checkout
+-- (rebuild: flask rebuild-sales-rollups)
+CREATE TABLE VendorSalesDaily (
+  userID    CHAR(36)      NOT NULL,               -- FK → Vendor
+  day       DATE          NOT NULL,
+  currency  ENUM('USD','EUR','AUD') NOT NULL,
+  revenue   DECIMAL(14,2) NOT NULL DEFAULT 0,
+  units     INT           NOT NULL DEFAULT 0,
+  PRIMARY KEY (userID, day, currency),
+  CONSTRAINT fk_vsd_vendor
+    FOREIGN KEY (userID) REFERENCES Vendor(userID)
+    ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+CREATE TABLE ImageSalesDaily (
+  imageID   CHAR(36)      NOT NULL,
+  day       DATE          NOT NULL,
+  currency  ENUM('USD','EUR','AUD') NOT NULL,
+  userID    CHAR(36)      NOT NULL,               -- vendor, for per-vendor windows
+  revenue   DECIMAL(14,2) NOT NULL DEFAULT 0,
+  units     INT           NOT NULL DEFAULT 0,
+  PRIMARY KEY (imageID, day, currency),
+  KEY idx_isd_vendor_day (userID, day),
+  CONSTRAINT fk_isd_image
+    FOREIGN KEY (imageID) REFERENCES Image(imageID)
+    ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+-- Per-image rating aggregates, rebuilt from Rating (the app has no rating writes)
+-- (rebuild: flask rebuild-rating-summary, verify: flask check-rating-summary)
+CREATE TABLE RatingSummary (
+  imageID     CHAR(36) NOT NULL,
+  ratingCount INT      NOT NULL DEFAULT 0,
+  ratingSum   INT      NOT NULL DEFAULT 0,
+  score0      INT      NOT NULL DEFAULT 0,
+  score1      INT      NOT NULL DEFAULT 0,
+  score2      INT      NOT NULL DEFAULT 0,
+  score3      INT      NOT NULL DEFAULT 0,
+  score4      INT      NOT NULL DEFAULT 0,
+  score5      INT      NOT NULL DEFAULT 0,
+  PRIMARY KEY (imageID),
+  CONSTRAINT fk_rs_image
+    FOREIGN KEY (imageID) REFERENCES Image(imageID)
+    ON UPDATE CASCADE ON DELETE CASCADE
+);
+
 CREATE TABLE ImageCategory (
   categoryID CHAR(36) NOT NULL,
   imageID    CHAR(36) NOT NULL,
+  -- copied from Image on every image write, so category gallery pages and
+  -- counts are read in order from idx_ic_gallery (flask rebuild-category-order)
+  updateDate DATE     NULL,
+  isVisible  BOOLEAN  NOT NULL DEFAULT FALSE,        -- Active and not deleted
   PRIMARY KEY (categoryID, imageID),
   KEY idx_ic_image (imageID),
+  KEY idx_ic_gallery (categoryID, isVisible, updateDate, imageID),
   CONSTRAINT fk_ic_category
     FOREIGN KEY (categoryID) REFERENCES Category(categoryID)
     ON UPDATE CASCADE ON DELETE CASCADE,
@@ -249,6 +388,11 @@ INSERT INTO ImageCategory (categoryID, imageID) VALUES
 ('45836d76-fcb9-481c-b585-d0d656d8bc04','5d4c555e-5c00-4292-9fc7-8e5ce8f27453'),
 ('45836d76-fcb9-481c-b585-d0d656d8bc04','1acc0192-cb36-49c5-ad30-565102b885ce');
 
+UPDATE ImageCategory AS ic
+JOIN Image AS i ON i.imageID = ic.imageID
+SET ic.updateDate = i.updateDate,
+    ic.isVisible = (i.isDeleted = FALSE AND i.imageStatus = 'Active');
+
 -- =========================
 -- PURCHASES (+ items)
 INSERT INTO Purchase (purchaseID, userID, purchaseDate, totalAmount) VALUES
@@ -265,6 +409,42 @@ INSERT INTO PurchaseImage (purchaseID, imageID) VALUES
 ('3edae5e8-f652-4edb-8f08-e4a7d2fb6c99','8d869d66-74ad-4276-95a0-80bf42ee037e'),
 ('3edae5e8-f652-4edb-8f08-e4a7d2fb6c99','4744f11c-d328-49c9-a86b-65e6f949f795');
 
+-- seeded purchases were paid at the current image prices
+UPDATE PurchaseImage AS pi
+JOIN Image AS i ON i.imageID = pi.imageID
+SET pi.price = i.price, pi.currency = i.currency;
+
+-- lifetime spend and rank from the seeded purchases, as `flask recompute-ranks`
+-- does with the default CURRENCY_RATES and RANK_THRESHOLDS of create_app()
+UPDATE Customer AS c
+LEFT JOIN (
+    SELECT p.userID, ROUND(SUM(pi.price * r.rate), 2) AS total
+    FROM Purchase AS p
+    JOIN PurchaseImage AS pi ON pi.purchaseID = p.purchaseID
+    JOIN (SELECT 'USD' AS currency, 1.0 AS rate
+          UNION ALL SELECT 'EUR', 1.08
+          UNION ALL SELECT 'AUD', 0.66) AS r ON r.currency = pi.currency
+    GROUP BY p.userID
+) AS spend ON spend.userID = c.userID
+SET c.totalSpend = COALESCE(spend.total, 0),
+    c.customerRank = CASE WHEN COALESCE(spend.total, 0) >= 500 THEN 'Gold'
+                          WHEN COALESCE(spend.total, 0) >= 100 THEN 'Silver'
+                          ELSE 'Bronze' END;
+
+INSERT INTO VendorSalesDaily (userID, day, currency, revenue, units)
+SELECT i.userID, p.purchaseDate, pi.currency, SUM(pi.price), COUNT(*)
+FROM PurchaseImage AS pi
+JOIN Purchase AS p ON p.purchaseID = pi.purchaseID
+JOIN Image AS i ON i.imageID = pi.imageID
+GROUP BY i.userID, p.purchaseDate, pi.currency;
+
+INSERT INTO ImageSalesDaily (imageID, day, currency, userID, revenue, units)
+SELECT pi.imageID, p.purchaseDate, pi.currency, i.userID, SUM(pi.price), COUNT(*)
+FROM PurchaseImage AS pi
+JOIN Purchase AS p ON p.purchaseID = pi.purchaseID
+JOIN Image AS i ON i.imageID = pi.imageID
+GROUP BY pi.imageID, p.purchaseDate, pi.currency, i.userID;
+
 -- =========================
 -- RATINGS
 INSERT INTO Rating (ratingID, userID, imageID, score, comment, updateDate) VALUES
@@ -275,6 +455,12 @@ INSERT INTO Rating (ratingID, userID, imageID, score, comment, updateDate) VALUE
 ('b18a073b-79fd-425c-81bc-f24dc5756870','e4face8e-0a91-40c8-9090-34433e0222c1','7614f542-34db-4646-a4e8-4d4ea51bb57e',3,'Good texture','2025-10-08'),
 ('63bd2fdb-a495-471c-b3e1-ca932000217a','d2c29738-9369-49e9-a139-83e9ce2837ac','5d4c555e-5c00-4292-9fc7-8e5ce8f27453',5,'Fantastic trails','2025-10-09');
 
+INSERT INTO RatingSummary (imageID, ratingCount, ratingSum, score0, score1, score2, score3, score4, score5)
+SELECT imageID, COUNT(*), SUM(score),
+       SUM(score = 0), SUM(score = 1), SUM(score = 2), SUM(score = 3), SUM(score = 4), SUM(score = 5)
+FROM Rating
+GROUP BY imageID;
+
 -- =========================
 -- CART
 INSERT INTO CartImage (userID, imageID) VALUES
@@ -1,14 +1,31 @@
 from __future__ import annotations  # For forward references in type hints
-from project.models import (Admin, Category, Customer, CustomerRank, Image, Purchase, Rating, Role, Vendor)
+from project.models import (Admin, CartLine, CartSummary, Category, Customer, CustomerRank, Image, Purchase, Rating, Role, Vendor)
 from datetime import datetime
+import json
+import time
+import MySQLdb
+import MySQLdb.cursors
+from flask import current_app, g
 from project.utils import generate_uuid
+from project.cache import Cache
+from project.metrics import instrumented
 from . import mysql
 from project.models import User
 
-def get_images_sort(page=1, per_page=8, category_id=None):
-    offset = (page - 1) * per_page
+# Read-only helpers query mysql.reader, which is a replica when MYSQL_REPLICAS
+# is set; writes, the job queue and sessions always use the primary
+
+# Gallery paging uses keyset (cursor) pagination on (updateDate, imageID) so
+# deep pages cost the same as the first one
+
+
+def get_images_page(category_id=None, after=None, before=None, per_page=8):
+    """Return (rows, has_more) for one gallery page, newest first.
 
-    base_query = """
+    after/before are (updateDate, imageID) cursors: after gives the page that
+    follows that image, before gives the page that precedes it.
+    """
+    query = """
         SELECT 
             i.imageID,
             i.title,
@@ -21,49 +38,141 @@ def get_images_sort(page=1, per_page=8, category_id=None):
             i.extension,
             i.userID
         FROM Image i
-        WHERE i.isDeleted = FALSE
-          AND i.imageStatus = 'Active'
     """
-
+    params = []
+    # category pages walk idx_ic_gallery, which carries the order and visibility
     if category_id and category_id != 'all':
-        base_query = """
-            SELECT 
-                i.imageID,
-                i.title,
-                i.description,
-                i.price,
-                i.currency,
-                i.updateDate,
-                i.imageStatus,
-                i.quantity,
-                i.extension,
-                i.userID
-            FROM Image i
+        query += """
             JOIN ImageCategory ic ON i.imageID = ic.imageID
+            WHERE ic.categoryID = %s
+              AND ic.isVisible = TRUE
+        """
+        params.append(category_id)
+        key = 'ic'
+    else:
+        query += """
             WHERE i.isDeleted = FALSE
               AND i.imageStatus = 'Active'
-              AND ic.categoryID = %s
         """
-        params = (category_id, per_page, offset)
+        key = 'i'
+
+    if before:
+        query += f""" AND ({key}.updateDate > %s OR ({key}.updateDate = %s AND {key}.imageID > %s))
+            ORDER BY {key}.updateDate ASC, {key}.imageID ASC LIMIT %s;"""
+        params += [before[0], before[0], before[1], per_page + 1]
+    elif after:
+        query += f""" AND ({key}.updateDate < %s OR ({key}.updateDate = %s AND {key}.imageID < %s))
+            ORDER BY {key}.updateDate DESC, {key}.imageID DESC LIMIT %s;"""
+        params += [after[0], after[0], after[1], per_page + 1]
     else:
-        params = (per_page, offset)
+        query += f" ORDER BY {key}.updateDate DESC, {key}.imageID DESC LIMIT %s;"
+        params.append(per_page + 1)
 
-    base_query += " ORDER BY i.updateDate DESC LIMIT %s OFFSET %s;"
-    with mysql.connection.cursor() as cur:
-        cur.execute(base_query, params)
-        return cur.fetchall()
+    with mysql.reader.cursor() as cur:
+        cur.execute(query, params)
+        rows = list(cur.fetchall())
 
-def count_images(category_id=None):
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
+    return rows, has_more
+
+
+# Full-text search over image titles/descriptions and category names, using
+# the FULLTEXT indexes. Each index contributes at most SEARCH_CANDIDATE_LIMIT
+# best matches, which keeps latency bounded however large the catalog gets.
+SEARCH_CANDIDATE_LIMIT = 1000
+
+
+def search_images(query: str, category_id=None, after=None, per_page=8):
+    """Return (rows, has_more) ranked by relevance, best first.
+
+    after is a (relevance, imageID) cursor taken from the last row of the
+    previous page.
+    """
+    # visibility and the category filter go inside the candidate queries, so
+    # hidden images or other categories never take up candidate slots
+    categoryJoin, categoryParams = "", []
     if category_id and category_id != 'all':
+        categoryJoin = "JOIN ImageCategory f ON f.imageID = i.imageID AND f.categoryID = %s"
+        categoryParams = [category_id]
+    sql = f"""
+        SELECT 
+            i.imageID,
+            i.title,
+            i.description,
+            i.price,
+            i.currency,
+            i.updateDate,
+            i.imageStatus,
+            i.quantity,
+            i.extension,
+            i.userID,
+            s.relevance
+        FROM (
+            SELECT hits.imageID, ROUND(SUM(hits.score), 6) AS relevance
+            FROM (
+                (SELECT i.imageID,
+                        MATCH(i.title, i.description) AGAINST (%s IN NATURAL LANGUAGE MODE) AS score
+                 FROM Image i
+                 {categoryJoin}
+                 WHERE MATCH(i.title, i.description) AGAINST (%s IN NATURAL LANGUAGE MODE)
+                   AND i.isDeleted = FALSE
+                   AND i.imageStatus = 'Active'
+                 ORDER BY score DESC
+                 LIMIT %s)
+                UNION ALL
+                (SELECT ic.imageID,
+                        MATCH(c.categoryName) AGAINST (%s IN NATURAL LANGUAGE MODE) AS score
+                 FROM Category c
+                 JOIN ImageCategory ic ON c.categoryID = ic.categoryID
+                 JOIN Image i ON i.imageID = ic.imageID
+                 {categoryJoin}
+                 WHERE MATCH(c.categoryName) AGAINST (%s IN NATURAL LANGUAGE MODE)
+                   AND i.isDeleted = FALSE
+                   AND i.imageStatus = 'Active'
+                 ORDER BY score DESC
+                 LIMIT %s)
+            ) AS hits
+            GROUP BY hits.imageID
+        ) AS s
+        JOIN Image i ON i.imageID = s.imageID
+    """
+    params = [query, *categoryParams, query, SEARCH_CANDIDATE_LIMIT,
+              query, *categoryParams, query, SEARCH_CANDIDATE_LIMIT]
+    if after:
+        sql += " WHERE s.relevance < %s OR (s.relevance = %s AND i.imageID > %s)"
+        params += [after[0], after[0], after[1]]
+    sql += " ORDER BY s.relevance DESC, i.imageID ASC LIMIT %s;"
+    params.append(per_page + 1)
+
+    with mysql.reader.cursor() as cur:
+        cur.execute(sql, params)
+        rows = list(cur.fetchall())
+
+    return rows[:per_page], len(rows) > per_page
+
+
+# Gallery totals per category ('all' for everything). Writes adjust the cached
+# numbers in place; the TTL only bounds drift from other worker processes.
+count_cache = Cache(maxsize=1024, ttl=300)
+
+
+def count_images(category_id=None):
+    key = category_id if category_id and category_id != 'all' else 'all'
+    cached = count_cache.get(key)
+    if cached is not None:
+        return cached
+
+    if key != 'all':
         query = """
             SELECT COUNT(*) AS total
-            FROM Image i
-            JOIN ImageCategory ic ON i.imageID = ic.imageID
-            WHERE i.isDeleted = FALSE
-              AND i.imageStatus = 'Active'
-              AND ic.categoryID = %s;
+            FROM ImageCategory
+            WHERE categoryID = %s
+              AND isVisible = TRUE;
         """
-        params = (category_id,)
+        params = (key,)
     else:
         query = """
             SELECT COUNT(*) AS total
@@ -73,13 +182,46 @@ def count_images(category_id=None):
         """
         params = ()
 
-    with mysql.connection.cursor() as cur:
+    with mysql.reader.cursor() as cur:
         cur.execute(query, params)
-        return cur.fetchone()["total"]
+        total = cur.fetchone()["total"]
+    count_cache.set(key, total)
+    return total
+
+
+def _count_state(imageStatus, isDeleted, categoryIDs):
+    # what an image contributes to the gallery totals
+    return (imageStatus == 'Active' and not isDeleted, set(categoryIDs))
+
+
+def _image_count_state(cur, imageID):
+    # Current (imageStatus, isDeleted, categoryIDs) of an image. The image row
+    # stays locked until the surrounding transaction ends.
+    cur.execute("""
+        SELECT imageStatus, isDeleted FROM image WHERE imageID = %s FOR UPDATE
+    """, (imageID,))
+    row = cur.fetchone()
+    if not row:
+        return (None, True, set())
+    cur.execute(
+        "SELECT categoryID FROM imagecategory WHERE imageID = %s", (imageID,))
+    categories = {r['categoryID'] for r in cur.fetchall()}
+    return (row['imageStatus'], bool(row['isDeleted']), categories)
+
+
+def _apply_count_delta(before, after):
+    beforeVisible, beforeCategories = before
+    afterVisible, afterCategories = after
+    count_cache.incr('all', int(afterVisible) - int(beforeVisible))
+    for categoryID in beforeCategories | afterCategories:
+        delta = int(afterVisible and categoryID in afterCategories) - \
+            int(beforeVisible and categoryID in beforeCategories)
+        if delta:
+            count_cache.incr(categoryID, delta)
 
 
 def get_status_user(userID: str):
-    cur = mysql.connection.cursor()
+    cur = mysql.reader.cursor()
     cur.execute("SELECT isDeleted FROM User WHERE userID = %s", (userID,))
     row = cur.fetchone()
     cur.close()
@@ -88,17 +230,77 @@ def get_status_user(userID: str):
     return None
 
 
-def get_categories():
+# Cross-process cache versions. Writers bump a counter in the CacheVersion
+# table inside their transaction; every process re-reads the counter at most
+# once per CACHE_VERSION_CHECK_INTERVAL seconds, which bounds how long another
+# worker can serve stale data.
+CACHE_VERSION_CHECK_INTERVAL = 5
+_cache_versions = {}  # name -> (version, checked at)
+
+
+def get_cache_version(name: str):
+    entry = _cache_versions.get(name)
+    now = time.monotonic()
+    if entry and now - entry[1] < CACHE_VERSION_CHECK_INTERVAL:
+        return entry[0]
+    # always from the primary: a lagging replica would pin an old version for
+    # every request of this process, including ones that just wrote
     cur = mysql.connection.cursor()
+    cur.execute("SELECT version FROM CacheVersion WHERE name = %s", (name,))
+    row = cur.fetchone()
+    cur.close()
+    version = row['version'] if row else 0
+    _cache_versions[name] = (version, now)
+    return version
+
+
+def _bump_cache_version(cur, name: str):
+    cur.execute("""
+        INSERT INTO CacheVersion (name, version) VALUES (%s, 1)
+        ON DUPLICATE KEY UPDATE version = version + 1
+    """, (name,))
+
+
+def _forget_cache_version(name: str):
+    # after a commit, make this process re-read the version straight away
+    _cache_versions.pop(name, None)
+
+
+def bump_cache_version(name: str):
+    """Retire cached pages of `name` in every process, outside any other write."""
+    cur = mysql.connection.cursor()
+    try:
+        _bump_cache_version(cur, name)
+        mysql.connection.commit()
+    except Exception as e:
+        print("Error bumping cache version:", e)
+        mysql.connection.rollback()
+        raise
+    finally:
+        cur.close()
+    _forget_cache_version(name)
+
+
+# Categories almost never change: keep them per version of 'categories'
+category_cache = Cache(maxsize=4)
+
+
+def _load_categories():
+    cur = mysql.reader.cursor()
     cur.execute(
         "SELECT categoryID, categoryName, description FROM Category ORDER BY categoryName")
     rows = cur.fetchall()
     cur.close()
-    return [Category(
+    return tuple(Category(
         categoryID=row['categoryID'],
         categoryName=row['categoryName'],
         description=row['description']
-    ) for row in rows] if rows else []
+    ) for row in rows)
+
+
+def get_categories():
+    version = get_cache_version('categories')
+    return list(category_cache.get_or_set(version, _load_categories))
 
 
 def add_category(category: Category):
@@ -109,7 +311,9 @@ def add_category(category: Category):
     data = (category.categoryID, category.categoryName, category.description)
     try:
         cur.execute(query, data)
+        _bump_cache_version(cur, 'categories')
         mysql.connection.commit()
+        _forget_cache_version('categories')
         return True
     except Exception as e:
         print("Error adding category:", e)
@@ -129,7 +333,9 @@ def edit_category(category: Category):
     data = (category.categoryName, category.description, category.categoryID)
     try:
         cur.execute(query, data)
+        _bump_cache_version(cur, 'categories')
         mysql.connection.commit()
+        _forget_cache_version('categories')
         return True
     except Exception as e:
         print("Error updating category:", e)
@@ -144,7 +350,9 @@ def delete_category(categoryID: str):
     try:
         cur.execute("DELETE FROM Category WHERE categoryID = %s",
                     (categoryID,))
+        _bump_cache_version(cur, 'categories')
         mysql.connection.commit()
+        _forget_cache_version('categories')
         return True
     except Exception as e:
         print("Error deleting category:", e)
@@ -155,7 +363,7 @@ def delete_category(categoryID: str):
 
 
 def get_ratings(userID=None, imageID=None):
-    cur = mysql.connection.cursor()
+    cur = mysql.reader.cursor()
     listRating = []
     if (userID is None and imageID is None):
         pass
@@ -220,9 +428,65 @@ def get_ratings(userID=None, imageID=None):
     return listRating
 
 
-def get_image_categories(imageID):
+# RatingSummary holds count, sum and histogram per image. The app never writes
+# ratings (they come from seed data), so it is filled by rebuild_rating_summaries
+RATING_SCORES = range(0, 6)
+
+
+_SUMMARY_SELECT = """
+    SELECT imageID, COUNT(*) AS ratingCount, SUM(score) AS ratingSum, {}
+    FROM rating
+    GROUP BY imageID
+""".format(', '.join(f'SUM(score = {s}) AS score{s}' for s in RATING_SCORES))
+
+
+def rebuild_rating_summaries():
+    # recompute every summary from the Rating table in one statement
+    columns = ', '.join(f'score{s}' for s in RATING_SCORES)
+    cur = mysql.connection.cursor()
+    try:
+        cur.execute("DELETE FROM RatingSummary")
+        cur.execute(f"""
+            INSERT INTO RatingSummary (imageID, ratingCount, ratingSum, {columns})
+            {_SUMMARY_SELECT}
+        """)
+        count = cur.rowcount
+        mysql.connection.commit()
+        return count
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cur.close()
 
+
+def check_rating_summaries():
+    # imageIDs whose stored summary differs from what the Rating rows say
+    histogramMismatch = ' OR '.join(
+        f'COALESCE(rs.score{s}, 0) <> COALESCE(r.score{s}, 0)' for s in RATING_SCORES)
     cur = mysql.connection.cursor()
+    cur.execute(f"""
+        SELECT r.imageID
+        FROM ({_SUMMARY_SELECT}) AS r
+        LEFT JOIN RatingSummary AS rs ON rs.imageID = r.imageID
+        WHERE rs.imageID IS NULL
+           OR rs.ratingCount <> r.ratingCount
+           OR rs.ratingSum <> r.ratingSum
+           OR {histogramMismatch}
+        UNION
+        SELECT rs.imageID
+        FROM RatingSummary AS rs
+        LEFT JOIN rating AS x ON x.imageID = rs.imageID
+        WHERE x.imageID IS NULL AND rs.ratingCount <> 0
+    """)
+    results = cur.fetchall()
+    cur.close()
+    return [row['imageID'] for row in results]
+
+
+def get_image_categories(imageID):
+
+    cur = mysql.reader.cursor()
     cur.execute("""
         SELECT c.categoryID, c.categoryName, c.description
         FROM category c
@@ -243,26 +507,126 @@ def get_image_categories(imageID):
 
     return listCategory
 
+
+# Bulk loading for listings: fetch the categories of a whole batch of images
+# in one query instead of one per image; rating summaries are joined in
+
+
+# keep IN lists to a sane size for very large batches
+IN_CHUNK_SIZE = 1000
+
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def _chunks(values, size=IN_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def get_categories_by_images(imageIDs):
+    categoriesByImage = {imageID: [] for imageID in imageIDs}
+    if not imageIDs:
+        return categoriesByImage
+    results = []
+    cur = mysql.reader.cursor()
+    for chunk in _chunks(list(imageIDs)):
+        cur.execute("""
+            SELECT ic.imageID, c.categoryID, c.categoryName, c.description
+            FROM category c
+            JOIN imagecategory ic ON c.categoryID = ic.categoryID
+            WHERE ic.imageID IN ({})
+        """.format(_placeholders(chunk)), chunk)
+        results.extend(cur.fetchall())
+    cur.close()
+    for row in results:
+        categoriesByImage[row['imageID']].append(Category(
+            categoryID=row['categoryID'],
+            categoryName=row['categoryName'],
+            description=row.get('description', '')
+        ))
+    return categoriesByImage
+
+
+# listing queries select these with
+#   LEFT JOIN RatingSummary AS rs ON rs.imageID = <image>.imageID
+# so the summaries come back on the image rows themselves
+RATING_SUMMARY_COLUMNS = ', '.join(
+    ['COALESCE(rs.ratingCount, 0) AS ratingCount', 'COALESCE(rs.ratingSum, 0) AS ratingSum']
+    + [f'COALESCE(rs.score{s}, 0) AS score{s}' for s in RATING_SCORES])
+
+
+def hydrate_images(rows):
+    # Build Image objects for a batch of image rows selected with
+    # RATING_SUMMARY_COLUMNS: one more query fetches all their categories
+    if not rows:
+        return []
+    imageIDs = list(dict.fromkeys(row['imageID'] for row in rows))
+    categoriesByImage = get_categories_by_images(imageIDs)
+
+    return [Image(
+        userID=row['userID'],
+        listCategory=list(categoriesByImage.get(row['imageID'], [])),
+        imageID=row['imageID'],
+        title=row['title'],
+        description=row['description'],
+        price=float(row['price']),
+        quantity=int(row.get('quantity') or 0),
+        currency=row['currency'],
+        imageStatus=row['imageStatus'],
+        extension=row['extension'],
+        updateDate=datetime.combine(row['updateDate'], datetime.min.time()),
+        ratingCount=int(row['ratingCount']),
+        ratingSum=int(row['ratingSum']),
+        ratingHistogram=[int(row[f'score{s}']) for s in RATING_SCORES]
+    ) for row in rows]
+
 # This is for list all images
 
 # Vendor site, to get only categoryID and categoryName for each image
 
 
 def get_all_categories():
-    cur = mysql.connection.cursor()
-    cur.execute(
-        "SELECT categoryID, categoryName FROM category ORDER BY categoryName ASC")
-    results = cur.fetchall()
-    cur.close()
-    return [(str(r['categoryID']), r['categoryName']) for r in results]
+    return [(str(c.categoryID), c.categoryName) for c in get_categories()]
 
 # Vendor site, to fetch seleted categories based on each imageID
 
 
+def _sync_image_category_order(cur, imageID=None):
+    # copy updateDate and visibility onto the image's ImageCategory rows
+    # (every image with imageID=None); call after each image write
+    where, params = ("WHERE ic.imageID = %s", [imageID]) if imageID else ("", [])
+    cur.execute(f"""
+        UPDATE ImageCategory AS ic
+        JOIN Image AS i ON i.imageID = ic.imageID
+        SET ic.updateDate = i.updateDate,
+            ic.isVisible = (i.isDeleted = FALSE AND i.imageStatus = 'Active')
+        {where}
+    """, params)
+
+
+def rebuild_image_category_order():
+    """Recopy updateDate and visibility from Image to every ImageCategory row."""
+    cur = mysql.connection.cursor()
+    try:
+        _sync_image_category_order(cur)
+        count = cur.rowcount
+        mysql.connection.commit()
+        return count
+    except Exception as e:
+        print("Error rebuilding category order:", e)
+        mysql.connection.rollback()
+        raise
+    finally:
+        cur.close()
+
+
 def update_image_categories(imageID, categoryIDs):
 
     cur = mysql.connection.cursor()
     try:
+        imageStatus, isDeleted, oldCategories = _image_count_state(cur, imageID)
         # Delete old category assignments
         cur.execute("DELETE FROM imagecategory WHERE imageID = %s", (imageID,))
 
@@ -272,7 +636,12 @@ def update_image_categories(imageID, categoryIDs):
                 "INSERT INTO imagecategory (imageID, categoryID) VALUES (%s, %s)",
                 (imageID, cat_id)
             )
+        _sync_image_category_order(cur, imageID)
+        _bump_cache_version(cur, 'catalog')
         mysql.connection.commit()
+        _forget_cache_version('catalog')
+        _apply_count_delta(_count_state(imageStatus, isDeleted, oldCategories),
+                           _count_state(imageStatus, isDeleted, categoryIDs))
     except Exception as e:
         print("Error updating image categories:", e)
         mysql.connection.rollback()
@@ -281,116 +650,103 @@ def update_image_categories(imageID, categoryIDs):
 
 
 def get_images():
-    cur = mysql.connection.cursor()
+    cur = mysql.reader.cursor()
     cur.execute("""
                 SELECT 
-                    *
+                    image.*, {}
                 FROM image
-                """)
+                LEFT JOIN RatingSummary AS rs ON rs.imageID = image.imageID
+                """.format(RATING_SUMMARY_COLUMNS))
     results = cur.fetchall()
-    listImage = []
-    if results:
-        listImage = [Image(
-            userID=row['userID'], listCategory=get_image_categories(imageID=row['imageID']), imageID=row['imageID'], title=row['title'], description=row['description'],
-            price=float(row['price']), quantity=int(row['quantity']), currency=row['currency'], imageStatus=row['imageStatus'], extension=row['extension'],
-            updateDate=datetime.combine(row['updateDate'], datetime.min.time()), listRatings=get_ratings(imageID=row['imageID'])) for row in results]
-    else:
-        listImage = []
-
     cur.close()
-    return listImage
+    return hydrate_images(results)
 
 
 def get_image(imageID: str):
-    cur = mysql.connection.cursor()
+    cur = mysql.reader.cursor()
     cur.execute("""
                 SELECT 
-                    *
-                FROM image WHERE imageID = %s AND isDeleted = False;
-                """, [imageID])
+                    image.*, {}
+                FROM image
+                LEFT JOIN RatingSummary AS rs ON rs.imageID = image.imageID
+                WHERE image.imageID = %s AND image.isDeleted = False;
+                """.format(RATING_SUMMARY_COLUMNS), [imageID])
     result = cur.fetchone()
-    image = Image(
-        userID=result['userID'], listCategory=get_image_categories(imageID=result['imageID']), imageID=result['imageID'], title=result['title'], description=result['description'],
-        price=float(result['price']), quantity=int(result['quantity']), currency=result['currency'], imageStatus=result['imageStatus'], extension=result['extension'],
-        updateDate=datetime.combine(result['updateDate'], datetime.min.time()), listRatings=get_ratings(imageID=result['imageID'])
-    ) if result else None
-
     cur.close()
-    return image
+    images = hydrate_images([result]) if result else []
+    return images[0] if images else None
 
 
 def get_images_by_page(page: int, per_page: int):
     offset = (page - 1) * per_page
-    cur = mysql.connection.cursor()
+    cur = mysql.reader.cursor()
     cur.execute("""
-            SELECT *
+            SELECT image.*, {}
             FROM image
+            LEFT JOIN RatingSummary AS rs ON rs.imageID = image.imageID
             WHERE image.imageStatus = 'Active' AND image.isDeleted = FALSE
             ORDER BY image.updateDate DESC
             LIMIT %s OFFSET %s;
-        """, (per_page, offset))
+        """.format(RATING_SUMMARY_COLUMNS), (per_page, offset))
     results = cur.fetchall()
     cur.close()
 
-    images = []
-    for row in results:
-        image = Image(
-            userID=row['userID'],
-            listCategory=get_image_categories(imageID=row['imageID']),
-            imageID=row['imageID'],
-            title=row['title'],
-            description=row['description'],
-            price=float(row['price']),
-            quantity=int(row['quantity']),
-            currency=row['currency'],
-            imageStatus=row['imageStatus'],
-            extension=row['extension'],
-            updateDate=datetime.combine(
-                row['updateDate'], datetime.min.time()),
-            listRatings=get_ratings(imageID=row['imageID'])
-        )
-        images.append(image)
-
-    return images
+    return hydrate_images(results)
 
 
 def get_active_image():
-    cur = mysql.connection.cursor()
+    cur = mysql.reader.cursor()
     cur.execute("""
-            SELECT *
+            SELECT image.*, {}
             FROM image
+            LEFT JOIN RatingSummary AS rs ON rs.imageID = image.imageID
             WHERE image.imageStatus = 'Active' AND image.isDeleted = FALSE
             ORDER BY image.updateDate DESC;
-        """)
+        """.format(RATING_SUMMARY_COLUMNS))
     result = cur.fetchall()
     cur.close()
 
-    active_images = []
-    for row in result:
-        image = Image(
-            userID=row['userID'],
-            listCategory=get_image_categories(imageID=row['imageID']),
-            imageID=row['imageID'],
-            title=row['title'],
-            description=row['description'],
-            price=float(row['price']),
-            quantity=int(row['quantity']),
-            currency=row['currency'],
-            imageStatus=row['imageStatus'],
-            extension=row['extension'],
-            updateDate=datetime.combine(
-                row['updateDate'], datetime.min.time()),
-            listRatings=get_ratings(imageID=row['imageID'])
-        )
-        active_images.append(image)
+    return hydrate_images(result)
+
+# Homepage feeds: top-N lists ordered and limited in MySQL. They are cached per
+# version of 'catalog' (image writes) and 'sales' (checkouts), so every process
+# stops serving a feed once any process changes what it lists
+feed_cache = Cache(maxsize=32, ttl=60)
+
+
+def _get_feed(order_by: str, limit: int):
+    cur = mysql.reader.cursor()
+    cur.execute("""
+            SELECT image.*, {}
+            FROM image
+            LEFT JOIN RatingSummary AS rs ON rs.imageID = image.imageID
+            WHERE image.imageStatus = 'Active' AND image.isDeleted = FALSE
+            ORDER BY {}
+            LIMIT %s;
+        """.format(RATING_SUMMARY_COLUMNS, order_by), (limit,))
+    result = cur.fetchall()
+    cur.close()
+
+    return hydrate_images(result)
+
+
+def get_best_seller_images(limit: int = 4):
+    # all DESC, so idx_image_sales is read backwards without a filesort
+    key = ('best_sellers', limit, get_cache_version('catalog'), get_cache_version('sales'))
+    return feed_cache.get_or_set(key, lambda: _get_feed(
+        'image.quantity DESC, image.updateDate DESC, image.imageID DESC', limit))
+
 
-    return active_images
+def get_new_images(limit: int = 4):
+    key = ('new_images', limit, get_cache_version('catalog'))
+    return feed_cache.get_or_set(key, lambda: _get_feed(
+        'image.updateDate DESC, image.imageID DESC', limit))
 
 # Display vendor name in item detail page
 
 
 def get_vendorName(userID):
-    cur = mysql.connection.cursor()
+    cur = mysql.reader.cursor()
     cur.execute("SELECT username FROM user WHERE userID = %s", (userID,))
     row = cur.fetchone()
     cur.close()
@@ -402,39 +758,19 @@ def get_vendorName(userID):
 
 
 def get_images_by_vendor(vendor_id):
-    cur = mysql.connection.cursor()
+    cur = mysql.reader.cursor()
     cur.execute("""
         SELECT i.imageID, i.userID, i.title, i.description, i.price,
-               i.currency, i.extension, i.imageStatus, i.updateDate
+               i.currency, i.extension, i.imageStatus, i.updateDate, i.quantity, {}
         FROM image i
+        LEFT JOIN RatingSummary AS rs ON rs.imageID = i.imageID
         WHERE i.userID = %s AND i.isDeleted = False
         ORDER BY i.updateDate DESC
-    """, (vendor_id,))
+    """.format(RATING_SUMMARY_COLUMNS), (vendor_id,))
     results = cur.fetchall()
     cur.close()
 
-    images = []
-    for row in results:
-        # Fetch categories for each image
-        categories = get_image_categories(imageID=row['imageID'])
-        images.append(
-            Image(
-                imageID=str(row['imageID']),
-                userID=row['userID'],
-                title=row['title'],
-                description=row['description'],
-                price=float(row['price']),
-                currency=row['currency'],
-                imageStatus=row['imageStatus'],
-                updateDate=row['updateDate'],
-                extension=row['extension'],
-                listRatings=[],
-                quantity=0,
-                listCategory=categories
-            )
-        )
-
-    return images
+    return hydrate_images(results)
 
 # Update an existing image's details via vendor management
 
@@ -442,6 +778,7 @@ def get_images_by_vendor(vendor_id):
 def edit_image(imageID, title, description, price, currency, imageStatus, category_ids):
     cur = mysql.connection.cursor()
     try:
+        oldStatus, isDeleted, oldCategories = _image_count_state(cur, imageID)
 
         cur.execute("""
             UPDATE image
@@ -457,8 +794,13 @@ def edit_image(imageID, title, description, price, currency, imageStatus, catego
                 "INSERT INTO imagecategory (imageID, categoryID) VALUES (%s, %s)",
                 (imageID, cat_id)
             )
+        _sync_image_category_order(cur, imageID)
 
+        _bump_cache_version(cur, 'catalog')
         mysql.connection.commit()
+        _forget_cache_version('catalog')
+        _apply_count_delta(_count_state(oldStatus, isDeleted, oldCategories),
+                           _count_state(imageStatus, isDeleted, category_ids))
         return True
     except Exception as e:
         print("Error updating image:", e)
@@ -486,6 +828,7 @@ def delete_selected_image(image_id, isDeleted: bool):
                 UPDATE image 
                 SET isDeleted = TRUE
                 WHERE imageID = %s;""", (image_id,))
+    _sync_image_category_order(cur, image_id)
     mysql.connection.commit()
     cur.close()
 
@@ -495,12 +838,18 @@ def delete_selected_image(image_id, isDeleted: bool):
 def config_image(imageID: str, isDeleted: bool):
     try:
         cur = mysql.connection.cursor()
+        imageStatus, wasDeleted, categories = _image_count_state(cur, imageID)
         cur.execute("""
         UPDATE image
         SET isDeleted = %s
         WHERE imageID = %s
     """, [isDeleted, imageID])
+        _sync_image_category_order(cur, imageID)
+        _bump_cache_version(cur, 'catalog')
         mysql.connection.commit()
+        _forget_cache_version('catalog')
+        _apply_count_delta(_count_state(imageStatus, wasDeleted, categories),
+                           _count_state(imageStatus, isDeleted, categories))
         return True
     except Exception as e:
         print("Error updating image:", e)
@@ -519,6 +868,7 @@ def config_user(userID: str, isDeleted: bool):
         WHERE userID = %s
     """, [isDeleted, userID])
         mysql.connection.commit()
+        _forget_profile(userID)
         return True
     except Exception as e:
         print("Error updating image:", e)
@@ -528,32 +878,61 @@ def config_user(userID: str, isDeleted: bool):
         cur.close()
 
 
-def get_image_in_cart(userID: str):
-    cur = mysql.connection.cursor()
+def get_cart_lines(userID: str):
+    cur = mysql.reader.cursor()
     cur.execute("""
-        SELECT *
-        FROM CartImage 
-        WHERE userID = %s;
+        SELECT i.imageID, i.title, i.price, i.currency, i.extension
+        FROM CartImage AS c
+        JOIN image AS i ON c.imageID = i.imageID
+        WHERE c.userID = %s AND i.isDeleted = FALSE;
+    """, [userID])
+    results = cur.fetchall()
+    cur.close()
+    return [CartLine(
+        imageID=row['imageID'], title=row['title'], price=float(row['price']),
+        currency=row['currency'], extension=row['extension']
+    ) for row in results]
+
+
+def summarize_cart_lines(lines):
+    summary = CartSummary(count=len(lines))
+    for line in lines:
+        summary.totals[line.currency] = round(
+            summary.totals.get(line.currency, 0.0) + line.price, 2)
+    return summary
+
+
+def get_cart_summary(userID: str):
+    cur = mysql.reader.cursor()
+    cur.execute("""
+        SELECT i.currency, COUNT(*) AS items, SUM(i.price) AS total
+        FROM CartImage AS c
+        JOIN image AS i ON c.imageID = i.imageID
+        WHERE c.userID = %s AND i.isDeleted = FALSE
+        GROUP BY i.currency;
     """, [userID])
     results = cur.fetchall()
-    listImage = []
-    for row in results:
-        image = get_image(row['imageID'])
-        if image is not None:
-            listImage.append(image)
     cur.close()
-    return listImage
+    return CartSummary(
+        count=sum(int(row['items']) for row in results),
+        totals={row['currency']: round(float(row['total']), 2) for row in results})
 
 # add new image in vendor management
 
 
-def add_image(image: Image):
+def add_image(image: Image, blobSize: int = 0):
     cur = mysql.connection.cursor()
     queryAddImage = """
         INSERT INTO image (
             imageID, userID, title, description, price, currency,
-            updateDate, imageStatus, quantity, extension
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            updateDate, imageStatus, quantity, extension, blobHash
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """
+    # one row per distinct file; the Image rows with this blobHash reference it
+    queryAddBlob = """
+        INSERT INTO ImageBlob (sha256, extension, byteSize)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE lastUsedAt = CURRENT_TIMESTAMP
     """
     queryAddImageCategory = """
         INSERT INTO ImageCategory (
@@ -572,7 +951,8 @@ def add_image(image: Image):
         image.updateDate,
         image.imageStatus,
         image.quantity,
-        image.extension
+        image.extension,
+        image.blobHash
     )
 
     dataImageCategory = [(
@@ -580,10 +960,77 @@ def add_image(image: Image):
         image.imageID
     ) for category in image.listCategory]
 
+    if image.blobHash:
+        cur.execute(queryAddBlob, (image.blobHash, image.extension, blobSize))
     cur.execute(queryAddImage, dataImage)
     cur.executemany(queryAddImageCategory, dataImageCategory)
+    _sync_image_category_order(cur, image.imageID)
+    _bump_cache_version(cur, 'catalog')
     mysql.connection.commit()
+    _forget_cache_version('catalog')
+    cur.close()
+    _apply_count_delta(_count_state(None, True, []),
+                       _count_state(image.imageStatus, False, image.listCategory))
+
+
+def get_blob_twin(blobHash: str):
+    """Return the imageID of an existing image stored in the same blob, or None."""
+    cur = mysql.reader.cursor()
+    cur.execute("""
+        SELECT imageID FROM Image
+        WHERE blobHash = %s
+        LIMIT 1
+    """, (blobHash,))
+    row = cur.fetchone()
     cur.close()
+    return row['imageID'] if row else None
+
+
+def purge_unreferenced_blobs(minAgeSeconds: int):
+    """Delete ImageBlob rows no image references; returns the deleted hashes.
+
+    Images are only soft deleted, so a blob stays referenced for as long as
+    any Image row, deleted or not, points at it. Blobs uploaded again within
+    minAgeSeconds (lastUsedAt) are kept as well.
+    """
+    cur = mysql.connection.cursor()
+    try:
+        cur.execute("""
+            SELECT b.sha256 FROM ImageBlob AS b
+            WHERE b.lastUsedAt < NOW() - INTERVAL %s SECOND
+              AND NOT EXISTS (SELECT 1 FROM Image AS i WHERE i.blobHash = b.sha256)
+        """, (minAgeSeconds,))
+        candidates = [row['sha256'] for row in cur.fetchall()]
+        if not candidates:
+            return []
+        cur.execute(f"""
+            DELETE FROM ImageBlob
+            WHERE sha256 IN ({_placeholders(candidates)})
+              AND NOT EXISTS (SELECT 1 FROM Image AS i WHERE i.blobHash = ImageBlob.sha256)
+        """, candidates)
+        # an upload may have started using one of them in the meantime
+        cur.execute(f"SELECT sha256 FROM ImageBlob WHERE sha256 IN ({_placeholders(candidates)})",
+                    candidates)
+        kept = {row['sha256'] for row in cur.fetchall()}
+        mysql.connection.commit()
+        return [sha256 for sha256 in candidates if sha256 not in kept]
+    except Exception as e:
+        print("Error purging blobs:", e)
+        mysql.connection.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def get_known_blobs(hashes):
+    """Return the subset of hashes that have an ImageBlob row."""
+    if not hashes:
+        return set()
+    cur = mysql.connection.cursor()
+    cur.execute(f"SELECT sha256 FROM ImageBlob WHERE sha256 IN ({_placeholders(hashes)})", list(hashes))
+    rows = cur.fetchall()
+    cur.close()
+    return {row['sha256'] for row in rows}
 
 
 def add_to_cart(userID: str, imageID: str):
@@ -602,49 +1049,187 @@ def add_to_cart(userID: str, imageID: str):
     cur.close()
 
 
-def get_user(username, password):
-    cur = mysql.connection.cursor()
-    cur.execute("""
-        SELECT *
-        FROM user
-        WHERE username = %s AND password = %s AND isDeleted = FALSE
-    """, (username, password))
+# One round trip resolves the user and its role subtype columns; Customer and
+# Vendor are LEFT JOINed so the same query serves every role.
+_PROFILE_SELECT = """
+    SELECT u.userID, u.username, u.email, u.firstname, u.surname, u.phone,
+           u.role, u.isDeleted, c.customerRank, v.bio, v.portfolio
+    FROM User AS u
+    LEFT JOIN Customer AS c ON c.userID = u.userID
+    LEFT JOIN Vendor AS v ON v.userID = u.userID
+"""
+
+# short-lived per-process profiles, e.g. for the checkout page
+profile_cache = Cache(maxsize=10000, ttl=30)
+
+
+def _user_from_profile_row(row):
+    if row['role'] == Role.ADMIN.value:
+        return Admin(username=row['username'], userID=row['userID'], email=row['email'], firstname=row['firstname'], surname=row['surname'], phone=row['phone'])
+    if row['role'] == Role.VENDOR.value:
+        return _vendor_from_row(row)
+    return Customer(username=row['username'], userID=row['userID'], email=row['email'], firstname=row['firstname'], surname=row['surname'], phone=row['phone'], customerRank=row['customerRank'])
+
+
+def _load_profile(userID: str):
+    cur = mysql.reader.cursor()
+    cur.execute(_PROFILE_SELECT + " WHERE u.userID = %s", (userID,))
     row = cur.fetchone()
     cur.close()
-    if row:
-        if row['role'] == Role.ADMIN.value:
-            return get_admin(row['userID'])
-        elif row['role'] == Role.CUSTOMER.value:
-            return get_customer(row['userID'])
-        elif row['role'] == Role.VENDOR.value:
-            return get_vendor(row['userID'])
-    return None
+    return _user_from_profile_row(row) if row else None
 
 
-def get_all_users():
-    cur = mysql.connection.cursor()
-    cur.execute("""
-        SELECT *
-        FROM user
-    """)
-    results = cur.fetchall()
+def get_profile(userID: str):
+    return profile_cache.get_or_set(userID, lambda: _load_profile(userID))
+
+
+def _forget_profile(userID: str):
+    profile_cache.delete(userID)
+
+
+def get_user(username, password):
+    """Authenticate and return the role specific user object, or None."""
+    cur = mysql.reader.cursor()
+    cur.execute(_PROFILE_SELECT + " WHERE u.username = %s AND u.password = %s",
+                (username, password))
+    row = cur.fetchone()
     cur.close()
+    if not row or row['isDeleted']:
+        return None
+    user = _user_from_profile_row(row)
+    profile_cache.set(user.userID, user)
+    return user
+
+
+# Admin user directory. Pages are keyed on the unique username, so any page
+# costs one index range read however many accounts exist.
+USER_COLUMNS = "userID, username, email, firstname, surname, phone, role, isDeleted"
+EXPORT_BATCH_SIZE = 1000
+
+
+def _user_from_row(row):
+    return User(
+        username=row['username'],
+        role=Role(row['role']),
+        userID=row['userID'],
+        email=row['email'],
+        surname=row['surname'],
+        firstname=row['firstname'],
+        phone=row['phone'],
+        isDeleted=bool(row['isDeleted'])
+    )
+
+
+def _like_prefix(prefix: str):
+    # escape LIKE wildcards so the prefix matches literally
+    return prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _user_filters(role=None, isDeleted=None, prefix=None, prefixField='username'):
+    conditions = []
+    params = []
+    if role:
+        conditions.append("role = %s")
+        params.append(role)
+    if isDeleted is not None:
+        conditions.append("isDeleted = %s")
+        params.append(bool(isDeleted))
+    if prefix:
+        column = 'email' if prefixField == 'email' else 'username'
+        conditions.append(f"{column} LIKE %s")
+        params.append(_like_prefix(prefix))
+    return conditions, params
 
-    users = []
-    if results:
-        for row in results:
-            users.append(User(
-                username=row['username'],
-                role=Role(row['role']),
-                userID=row['userID'],
-                email=row['email'],
-                surname=row['surname'],
-                firstname=row['firstname'],
-                phone=row['phone'],
-                isDeleted=row['isDeleted']
-            ))
 
-    return users
+def _user_order(prefix=None, prefixField='username', **filters):
+    # email prefix searches page through idx_user_email in (email, username)
+    # order; every other filter has an index ending in username
+    return ('email', 'username') if prefix and prefixField == 'email' else ('username',)
+
+
+def user_cursor(user: User, **filters):
+    """Keyset cursor of a user for get_users_page with the same filters."""
+    return '\t'.join(getattr(user, column) for column in _user_order(**filters))
+
+
+def _user_keyset(columns, cursor: str, op: str):
+    values = cursor.split('\t', len(columns) - 1)
+    if len(values) != len(columns):
+        return None, []
+    if len(columns) == 1:
+        return f"{columns[0]} {op} %s", values
+    first, second = columns
+    return (f"({first} {op} %s OR ({first} = %s AND {second} {op} %s))",
+            [values[0], values[0], values[1]])
+
+
+def get_users_page(after=None, before=None, per_page=50, **filters):
+    """Return (users, has_more) for one page of users.
+
+    Pages are ordered by username, or by email then username for email prefix
+    searches. after/before are user_cursor() values: after gives the page that
+    follows that user, before the page that precedes it. filters go to
+    _user_filters.
+    """
+    conditions, params = _user_filters(**filters)
+    columns = _user_order(**filters)
+    condition = None
+    if before:
+        condition, values = _user_keyset(columns, before, '<')
+        order = "DESC"
+    else:
+        if after:
+            condition, values = _user_keyset(columns, after, '>')
+        order = "ASC"
+    if condition:
+        conditions.append(condition)
+        params += values
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with mysql.reader.cursor() as cur:
+        cur.execute(f"""
+            SELECT {USER_COLUMNS}
+            FROM User
+            {where}
+            ORDER BY {', '.join(f'{column} {order}' for column in columns)}
+            LIMIT %s
+        """, (*params, per_page + 1))
+        rows = list(cur.fetchall())
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
+    return [_user_from_row(row) for row in rows], has_more
+
+
+def iter_users(**filters):
+    """Yield every matching user row, in get_users_page order, with constant memory.
+
+    Uses an unbuffered server-side cursor: rows are read from MySQL in batches
+    as they are consumed instead of being loaded all at once.
+    """
+    conditions, params = _user_filters(**filters)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursorclass = MySQLdb.cursors.SSDictCursor
+    # same switch as the pool's cursors
+    if current_app.config['MYSQL_INSTRUMENT']:
+        cursorclass = instrumented(cursorclass)
+    cur = mysql.reader.cursor(cursorclass)
+    try:
+        cur.execute(f"""
+            SELECT {USER_COLUMNS}
+            FROM User
+            {where}
+            ORDER BY {', '.join(_user_order(**filters))}
+        """, params)
+        while True:
+            rows = cur.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cur.close()
 
 
 def remove_image_cart(userID: str, imageID: str):
@@ -680,43 +1265,271 @@ def remove_all_image_cart(userID: str):
         cur.close()
 
 
-def add_purchase(userID: str, listImage: list[Image]):
+# Customer ranks follow lifetime spend (Customer.totalSpend), kept in
+# RANK_BASE_CURRENCY so purchases in different currencies add up.
+
+def _to_base_currency(amount: float, currency):
+    rates = current_app.config['CURRENCY_RATES']
+    return amount * rates[getattr(currency, 'value', currency)]
+
+
+def _rank_case(column: str):
+    """SQL CASE giving the rank for a spend column, with its parameters."""
+    thresholds = sorted(current_app.config['RANK_THRESHOLDS'].items(),
+                        key=lambda item: item[1], reverse=True)
+    sql = "CASE {} ELSE %s END".format(
+        " ".join("WHEN {} >= %s THEN %s".format(column) for _ in thresholds))
+    params = [value for rank, minimum in thresholds for value in (minimum, rank)]
+    return sql, params + [CustomerRank.BRONZE.value]
+
+
+def recompute_customer_ranks():
+    """Recompute every customer's spend and rank from their purchases.
+
+    A single UPDATE over one GROUP BY, so it scales with the Purchase table
+    instead of issuing a query per customer. Returns the number of changed rows.
+    """
+    rates = current_app.config['CURRENCY_RATES']
+    ratesTable = " UNION ALL ".join(
+        "SELECT %s AS currency, %s AS rate" for _ in rates)
+    rankCase, rankParams = _rank_case('COALESCE(spend.total, 0)')
     cur = mysql.connection.cursor()
-    totalPrice = round(sum(image.price for image in listImage), 2)
-    purchaseID = generate_uuid()
     try:
-        queryPurchase = """
-            INSERT INTO Purchase(
-                purchaseID, userID, purchaseDate, totalAmount
-            ) VALUES (%s, %s, %s, %s)
-        """
-        dataPurchase = [
-            purchaseID,
-            userID,
-            datetime.now(),
-            totalPrice
-        ]
-
-        queryPurchaseImage = """
-            INSERT INTO PurchaseImage(
-                purchaseID, imageID) VALUES (%s, %s)
-        """
-        dataPurchaseImage = [(purchaseID, image.imageID)
-                             for image in listImage]
+        cur.execute(f"""
+            UPDATE Customer AS c
+            LEFT JOIN (
+                SELECT p.userID, ROUND(SUM(pi.price * r.rate), 2) AS total
+                FROM Purchase AS p
+                JOIN PurchaseImage AS pi ON pi.purchaseID = p.purchaseID
+                JOIN ({ratesTable}) AS r ON r.currency = pi.currency
+                GROUP BY p.userID
+            ) AS spend ON spend.userID = c.userID
+            SET c.totalSpend = COALESCE(spend.total, 0),
+                c.customerRank = {rankCase}
+        """, [value for item in rates.items() for value in item] + rankParams)
+        count = cur.rowcount
+        mysql.connection.commit()
+        return count
+    except Exception as e:
+        print("Error recomputing customer ranks:", e)
+        mysql.connection.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+# Daily sales rollups for vendor analytics, maintained at checkout so the
+# dashboard never scans PurchaseImage. {where} limits them to one purchase.
+_VENDOR_ROLLUP_SELECT = """
+    SELECT i.userID, p.purchaseDate, pi.currency, SUM(pi.price), COUNT(*)
+    FROM PurchaseImage AS pi
+    JOIN Purchase AS p ON p.purchaseID = pi.purchaseID
+    JOIN Image AS i ON i.imageID = pi.imageID
+    {where}
+    GROUP BY i.userID, p.purchaseDate, pi.currency
+"""
+_IMAGE_ROLLUP_SELECT = """
+    SELECT pi.imageID, p.purchaseDate, pi.currency, i.userID, SUM(pi.price), COUNT(*)
+    FROM PurchaseImage AS pi
+    JOIN Purchase AS p ON p.purchaseID = pi.purchaseID
+    JOIN Image AS i ON i.imageID = pi.imageID
+    {where}
+    GROUP BY pi.imageID, p.purchaseDate, pi.currency, i.userID
+"""
+
+
+def _add_sales_rollups(cur, purchaseID: str):
+    where = "WHERE pi.purchaseID = %s"
+    cur.execute(f"""
+        INSERT INTO VendorSalesDaily (userID, day, currency, revenue, units)
+        {_VENDOR_ROLLUP_SELECT.format(where=where)}
+        ON DUPLICATE KEY UPDATE
+            revenue = revenue + VALUES(revenue),
+            units = units + VALUES(units)
+    """, (purchaseID,))
+    cur.execute(f"""
+        INSERT INTO ImageSalesDaily (imageID, day, currency, userID, revenue, units)
+        {_IMAGE_ROLLUP_SELECT.format(where=where)}
+        ON DUPLICATE KEY UPDATE
+            revenue = revenue + VALUES(revenue),
+            units = units + VALUES(units)
+    """, (purchaseID,))
+
+
+def rebuild_sales_rollups():
+    # recompute both rollup tables from every purchase
+    cur = mysql.connection.cursor()
+    try:
+        cur.execute("DELETE FROM VendorSalesDaily")
+        cur.execute("DELETE FROM ImageSalesDaily")
+        cur.execute(f"""
+            INSERT INTO VendorSalesDaily (userID, day, currency, revenue, units)
+            {_VENDOR_ROLLUP_SELECT.format(where='')}
+        """)
+        count = cur.rowcount
+        cur.execute(f"""
+            INSERT INTO ImageSalesDaily (imageID, day, currency, userID, revenue, units)
+            {_IMAGE_ROLLUP_SELECT.format(where='')}
+        """)
+        mysql.connection.commit()
+        return count
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def get_vendor_daily_sales(userID: str, start, end):
+    cur = mysql.reader.cursor()
+    cur.execute("""
+        SELECT day, currency, revenue, units
+        FROM VendorSalesDaily
+        WHERE userID = %s AND day BETWEEN %s AND %s
+        ORDER BY day
+    """, (userID, start, end))
+    rows = cur.fetchall()
+    cur.close()
+    return list(rows)
+
+
+def get_vendor_image_sales(userID: str, start, end):
+    # per image and currency totals over the window; ranked by the caller
+    cur = mysql.reader.cursor()
+    cur.execute("""
+        SELECT s.imageID, i.title, s.currency, SUM(s.revenue) AS revenue, SUM(s.units) AS units
+        FROM ImageSalesDaily AS s
+        JOIN Image AS i ON i.imageID = s.imageID
+        WHERE s.userID = %s AND s.day BETWEEN %s AND %s
+        GROUP BY s.imageID, i.title, s.currency
+    """, (userID, start, end))
+    rows = cur.fetchall()
+    cur.close()
+    return list(rows)
+
+
+def _record_purchase(cur, userID: str, listImage, checkoutToken=None):
+    # Insert the Purchase and its PurchaseImage rows and bump the per-image
+    # sales counters. Runs inside the caller's transaction. The cart can mix
+    # currencies, so totalAmount is in RANK_BASE_CURRENCY like totalSpend.
+    totalPrice = round(sum(_to_base_currency(image.price, image.currency) for image in listImage), 2)
+    purchaseID = generate_uuid()
+    imageIDs = [image.imageID for image in listImage]
+
+    cur.execute("""
+        INSERT INTO Purchase(
+            purchaseID, userID, purchaseDate, totalAmount, checkoutToken
+        ) VALUES (%s, %s, %s, %s, %s)
+    """, [purchaseID, userID, datetime.now(), totalPrice, checkoutToken])
+
+    # executemany sends this as one multi-row INSERT; price and currency are
+    # kept as they were at the time of purchase
+    cur.executemany("""
+        INSERT INTO PurchaseImage(
+            purchaseID, imageID, price, currency) VALUES (%s, %s, %s, %s)
+    """, [(purchaseID, image.imageID, image.price, getattr(image.currency, 'value', image.currency))
+          for image in listImage])
+
+    cur.execute("""
+        UPDATE image
+        SET quantity = quantity + 1
+        WHERE imageID IN ({})
+    """.format(_placeholders(imageIDs)), imageIDs)
+
+    # incremental rank update; MySQL applies SET assignments left to right,
+    # so the CASE already sees the new totalSpend
+    rankCase, rankParams = _rank_case('totalSpend')
+    cur.execute(f"""
+        UPDATE Customer
+        SET totalSpend = totalSpend + %s,
+            customerRank = {rankCase}
+        WHERE userID = %s
+    """, [totalPrice, *rankParams, userID])
+
+    _add_sales_rollups(cur, purchaseID)
+    _bump_cache_version(cur, 'sales')
+    return purchaseID
+
 
-        cur.execute(queryPurchase, dataPurchase)
-        cur.executemany(queryPurchaseImage, dataPurchaseImage)
+def _after_purchase(userID: str):
+    # totalSpend and possibly customerRank changed
+    _forget_profile(userID)
+    # sales counters and purchased images changed: _record_purchase bumped 'sales'
+    _forget_cache_version('sales')
 
+
+def add_purchase(userID: str, listImage: list[Image]):
+    if not listImage:
+        return None
+    cur = mysql.connection.cursor()
+    try:
+        purchaseID = _record_purchase(cur, userID, listImage)
         mysql.connection.commit()
+        _after_purchase(userID)
+        return purchaseID
     except Exception as e:
         print("Error adding purchase:", e)
         mysql.connection.rollback()
+        return None
     finally:
         cur.close()
 
 
-def get_purchases_by_user(userID: str):
+def _get_purchase_by_token(cur, checkoutToken: str):
+    cur.execute(
+        "SELECT purchaseID FROM Purchase WHERE checkoutToken = %s", (checkoutToken,))
+    row = cur.fetchone()
+    return row['purchaseID'] if row else None
+
+
+def checkout_cart(userID: str, checkoutToken: str):
+    """Turn the user's cart into a purchase in a single transaction.
+
+    Returns the purchaseID, None when the cart is empty, or False on error.
+    A repeated call with the same checkoutToken (double submit, retry)
+    returns the original purchaseID without buying anything again.
+    """
     cur = mysql.connection.cursor()
+    try:
+        purchaseID = _get_purchase_by_token(cur, checkoutToken)
+        if purchaseID:
+            return purchaseID
+
+        # Lock the cart rows: a concurrent submit waits here, then finds the
+        # cart empty (or the token used)
+        cur.execute("""
+            SELECT i.imageID, i.price, i.currency
+            FROM CartImage AS c
+            JOIN image AS i ON c.imageID = i.imageID
+            WHERE c.userID = %s AND i.isDeleted = FALSE
+            FOR UPDATE
+        """, (userID,))
+        lines = [CartLine(imageID=row['imageID'], title='', price=float(row['price']),
+                          currency=row['currency'], extension='') for row in cur.fetchall()]
+        if not lines:
+            mysql.connection.rollback()
+            # a concurrent submit with this token may have just emptied the cart
+            return _get_purchase_by_token(cur, checkoutToken)
+
+        purchaseID = _record_purchase(cur, userID, lines, checkoutToken)
+        cur.execute("DELETE FROM CartImage WHERE userID = %s", (userID,))
+        mysql.connection.commit()
+        _after_purchase(userID)
+        return purchaseID
+    except MySQLdb.IntegrityError:
+        # the same token was committed by a concurrent request
+        mysql.connection.rollback()
+        return _get_purchase_by_token(cur, checkoutToken) or False
+    except Exception as e:
+        print("Error during checkout:", e)
+        mysql.connection.rollback()
+        return False
+    finally:
+        cur.close()
+
+
+def get_purchases_by_user(userID: str):
+    cur = mysql.reader.cursor()
     cur.execute("""
         SELECT *
         FROM Purchase
@@ -735,89 +1548,112 @@ def get_purchases_by_user(userID: str):
 
 
 def get_images_in_purchase(purchaseID: str):
-    cur = mysql.connection.cursor()
+    cur = mysql.reader.cursor()
     cur.execute("""
-        SELECT *
+        SELECT *, {}
         FROM image i
         JOIN PurchaseImage pi ON i.imageID = pi.imageID
+        LEFT JOIN RatingSummary AS rs ON rs.imageID = i.imageID
         WHERE pi.purchaseID = %s
-    """, (purchaseID,))
+    """.format(RATING_SUMMARY_COLUMNS), (purchaseID,))
     results = cur.fetchall()
     cur.close()
 
-    images = [Image(
-        userID=row['userID'], listCategory=get_image_categories(imageID=row['imageID']), imageID=row['imageID'], title=row['title'], description=row['description'],
-        price=float(row['price']), quantity=int(row['quantity']), currency=row['currency'], imageStatus=row['imageStatus'], extension=row['extension'],
-        updateDate=datetime.combine(row['updateDate'], datetime.min.time()), listRatings=get_ratings(imageID=row['imageID'])) for row in results]
-
-    return images
+    return hydrate_images(results)
 
 
 def get_images_by_user_purchase(userID: str):
-    cur = mysql.connection.cursor()
+    cur = mysql.reader.cursor()
     cur.execute("""
-        SELECT i.*
+        SELECT i.*, {}
         FROM image i
         JOIN PurchaseImage pi ON i.imageID = pi.imageID
         JOIN Purchase p ON pi.purchaseID = p.purchaseID
+        LEFT JOIN RatingSummary AS rs ON rs.imageID = i.imageID
         WHERE p.userID = %s
-    """, (userID,))
+    """.format(RATING_SUMMARY_COLUMNS), (userID,))
     results = cur.fetchall()
     cur.close()
 
-    images = [Image(
-        userID=row['userID'], listCategory=get_image_categories(imageID=row['imageID']), imageID=row['imageID'], title=row['title'], description=row['description'],
-        price=float(row['price']), quantity=int(row['quantity']), currency=row['currency'], imageStatus=row['imageStatus'], extension=row['extension'],
-        updateDate=datetime.combine(row['updateDate'], datetime.min.time()), listRatings=get_ratings(imageID=row['imageID'])) for row in results]
+    return hydrate_images(results)
 
-    return images
 
+# IDs of every image a user has bought, cached per user and version of
+# 'sales', so a checkout in any process retires them. Pages only need
+# membership checks, so there is no need to hydrate full Image objects.
+purchased_cache = Cache(maxsize=10000, ttl=600)
 
-def get_admin(userID: str):
-    cur = mysql.connection.cursor()
+
+def get_purchased_image_ids(userID: str):
+    key = (userID, get_cache_version('sales'))
+    cached = purchased_cache.get(key)
+    if cached is not None:
+        return cached
+
+    cur = mysql.reader.cursor()
     cur.execute("""
-        SELECT *
-        FROM user
-        JOIN admin ON user.userID = admin.userID
-        WHERE user.userID = %s
+        SELECT DISTINCT pi.imageID
+        FROM Purchase p
+        JOIN PurchaseImage pi ON p.purchaseID = pi.purchaseID
+        WHERE p.userID = %s
     """, (userID,))
-    row = cur.fetchone()
+    results = cur.fetchall()
     cur.close()
-    if row:
-        return Admin(username=row['username'], userID=row['userID'], email=row['email'], firstname=row['firstname'], surname=row['surname'], phone=row['phone'])
-    return None
+
+    imageIDs = frozenset(row['imageID'] for row in results)
+    purchased_cache.set(key, imageIDs)
+    return imageIDs
+
+
+def get_admin(userID: str):
+    user = get_profile(userID)
+    return user if isinstance(user, Admin) else None
 
 
 def get_customer(userID: str):
-    cur = mysql.connection.cursor()
-    cur.execute("""
-        SELECT *
-        FROM user AS u
-        JOIN customer AS c ON u.userID = c.userID
-        WHERE u.userID = %s
-    """, (userID,))
-    row = cur.fetchone()
-    print("Customer row:", row)
-    cur.close()
-    if row:
-        return Customer(username=row['username'], userID=row['userID'], email=row['email'], firstname=row['firstname'], surname=row['surname'], phone=row['phone'], customerRank=row['customerRank'])
-    return None
+    # vendors are customers too
+    user = get_profile(userID)
+    return user if isinstance(user, Customer) else None
+
+
+def _vendor_from_row(row):
+    return Vendor(username=row['username'], userID=row['userID'], email=row['email'], firstname=row['firstname'], surname=row['surname'], phone=row['phone'], customerRank=row['customerRank'], bio=row['bio'], portfolio=row['portfolio'])
+
+
+def _vendor_identity_map():
+    # Per-request identity map so each vendor is loaded at most once per request
+    if '_vendors' not in g:
+        g._vendors = {}
+    return g._vendors
+
+
+def get_vendors_by_ids(userIDs):
+    identityMap = _vendor_identity_map()
+    missing = [userID for userID in dict.fromkeys(userIDs)
+               if userID not in identityMap]
+
+    if missing:
+        cur = mysql.reader.cursor()
+        for chunk in _chunks(missing):
+            cur.execute("""
+                SELECT *
+                FROM user AS u
+                JOIN customer AS c ON u.userID = c.userID
+                JOIN vendor AS v ON u.userID = v.userID
+                WHERE u.userID IN ({})
+            """.format(_placeholders(chunk)), chunk)
+            for row in cur.fetchall():
+                identityMap[row['userID']] = _vendor_from_row(row)
+        cur.close()
+        # remember unknown ids too so they are not queried again
+        for userID in missing:
+            identityMap.setdefault(userID, None)
+
+    return {userID: identityMap[userID] for userID in userIDs}
 
 
 def get_vendor(userID: str):
-    cur = mysql.connection.cursor()
-    cur.execute("""
-        SELECT *
-        FROM user AS u
-        JOIN customer AS c ON u.userID = c.userID
-        JOIN vendor AS v ON u.userID = v.userID
-        WHERE u.userID = %s
-    """, (userID,))
-    row = cur.fetchone()
-    cur.close()
-    if row:
-        return Vendor(username=row['username'], userID=row['userID'], email=row['email'], firstname=row['firstname'], surname=row['surname'], phone=row['phone'], customerRank=row['customerRank'], bio=row['bio'], portfolio=row['portfolio'])
-    return None
+    return get_vendors_by_ids([userID]).get(userID)
 
 
 def add_customer(form, is_vendor=False):
@@ -879,10 +1715,11 @@ def change_role(userID: str, new_role: Role):
         """, (userID, '', ''))
     mysql.connection.commit()
     cur.close()
+    _forget_profile(userID)
 
 
 def check_user(username: str):
-    cur = mysql.connection.cursor()
+    cur = mysql.reader.cursor()
     cur.execute("""
         SELECT *
         FROM user
@@ -894,3 +1731,333 @@ def check_user(username: str):
         return True
     return False
 
+
+
+# Background jobs (see project/jobs.py). Rows stay in the Job table after they
+# finish so failures can be inspected; purge_jobs() removes old finished ones.
+
+def enqueue_job(kind: str, payload=None, dedupeKey: str = None, delay: float = 0,
+                maxAttempts: int = 5, cur=None):
+    """Queue a job and return its jobID.
+
+    Pass the caller's cursor to queue the job inside the caller's transaction,
+    so it only exists if that transaction commits. While a job with the same
+    dedupeKey is queued or running, its jobID is returned instead.
+    """
+    ownCursor = cur is None
+    if ownCursor:
+        cur = mysql.connection.cursor()
+    cur.execute("""
+        INSERT INTO Job (kind, payload, dedupeKey, maxAttempts, runAfter)
+        VALUES (%s, %s, %s, %s, NOW(6) + INTERVAL %s MICROSECOND)
+        ON DUPLICATE KEY UPDATE jobID = LAST_INSERT_ID(jobID)
+    """, (kind, json.dumps(payload or {}), dedupeKey, maxAttempts, int(delay * 1000000)))
+    jobID = cur.lastrowid
+    if ownCursor:
+        mysql.connection.commit()
+        cur.close()
+    return jobID
+
+
+def claim_job(workerID: str):
+    """Lock the next due job for this worker and mark it running, or return None."""
+    cur = mysql.connection.cursor()
+    try:
+        # SKIP LOCKED lets several workers poll the table without blocking each other
+        cur.execute("""
+            SELECT jobID, kind, payload, attempts, maxAttempts
+            FROM Job
+            WHERE status = 'queued' AND runAfter <= NOW(6)
+            ORDER BY runAfter, jobID
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        """)
+        row = cur.fetchone()
+        if row is None:
+            mysql.connection.commit()
+            return None
+        cur.execute("""
+            UPDATE Job
+            SET status = 'running', attempts = attempts + 1,
+                lockedBy = %s, lockedAt = NOW(6)
+            WHERE jobID = %s
+        """, (workerID, row['jobID']))
+        mysql.connection.commit()
+        row['attempts'] += 1
+        row['payload'] = json.loads(row['payload'])
+        return row
+    except MySQLdb.Error as e:
+        print("Error claiming job:", e)
+        mysql.connection.rollback()
+        return None
+    finally:
+        cur.close()
+
+
+def complete_job(jobID: int, workerID: str):
+    """Mark the job done; False when the worker's lease was already taken back."""
+    cur = mysql.connection.cursor()
+    cur.execute("""
+        UPDATE Job
+        SET status = 'done', finishedAt = NOW(6), lockedBy = NULL, lastError = NULL
+        WHERE jobID = %s AND lockedBy = %s AND status = 'running'
+    """, (jobID, workerID))
+    owned = cur.rowcount == 1
+    mysql.connection.commit()
+    cur.close()
+    return owned
+
+
+def fail_job(jobID: int, workerID: str, error: str, retryIn: float = None):
+    """Record a failed attempt: queue it again after retryIn seconds, or give up when None.
+
+    Returns False when the worker's lease was already taken back.
+    """
+    cur = mysql.connection.cursor()
+    if retryIn is None:
+        cur.execute("""
+            UPDATE Job
+            SET status = 'failed', finishedAt = NOW(6), lockedBy = NULL, lastError = %s
+            WHERE jobID = %s AND lockedBy = %s AND status = 'running'
+        """, (error, jobID, workerID))
+    else:
+        cur.execute("""
+            UPDATE Job
+            SET status = 'queued', lockedBy = NULL, lastError = %s,
+                runAfter = NOW(6) + INTERVAL %s MICROSECOND
+            WHERE jobID = %s AND lockedBy = %s AND status = 'running'
+        """, (error, int(retryIn * 1000000), jobID, workerID))
+    owned = cur.rowcount == 1
+    mysql.connection.commit()
+    cur.close()
+    return owned
+
+
+def requeue_stale_jobs(leaseSeconds: int):
+    """Give running jobs whose worker died (lease expired) back to the queue."""
+    cur = mysql.connection.cursor()
+    cur.execute("""
+        UPDATE Job
+        SET status = IF(attempts >= maxAttempts, 'failed', 'queued'),
+            lockedBy = NULL, lastError = 'worker lease expired'
+        WHERE status = 'running' AND lockedAt < NOW(6) - INTERVAL %s SECOND
+    """, (leaseSeconds,))
+    count = cur.rowcount
+    mysql.connection.commit()
+    cur.close()
+    return count
+
+
+def retry_job(jobID: int):
+    """Queue a failed job again with a fresh attempt budget."""
+    cur = mysql.connection.cursor()
+    try:
+        cur.execute("""
+            UPDATE Job
+            SET status = 'queued', attempts = 0, runAfter = NOW(6), finishedAt = NULL
+            WHERE jobID = %s AND status = 'failed'
+        """, (jobID,))
+        retried = cur.rowcount == 1
+        mysql.connection.commit()
+        return retried
+    except MySQLdb.IntegrityError:
+        # the same dedupeKey is already queued again
+        mysql.connection.rollback()
+        return False
+    finally:
+        cur.close()
+
+
+def get_job_stats():
+    cur = mysql.connection.cursor()
+    cur.execute("""
+        SELECT kind, status, COUNT(*) AS jobs, MIN(runAfter) AS oldestRunAfter
+        FROM Job
+        GROUP BY kind, status
+        ORDER BY kind, status
+    """)
+    rows = cur.fetchall()
+    cur.close()
+    return list(rows)
+
+
+_JOB_COLUMNS = """
+    jobID, kind, payload, dedupeKey, status, attempts, maxAttempts,
+    runAfter, lockedBy, lockedAt, lastError, createdAt, finishedAt
+"""
+
+
+def get_jobs(status: str = None, kind: str = None, limit: int = 50):
+    cur = mysql.connection.cursor()
+    conditions = []
+    params = []
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+    if kind:
+        conditions.append("kind = %s")
+        params.append(kind)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cur.execute(f"""
+        SELECT {_JOB_COLUMNS}
+        FROM Job
+        {where}
+        ORDER BY jobID DESC
+        LIMIT %s
+    """, (*params, limit))
+    rows = cur.fetchall()
+    cur.close()
+    for row in rows:
+        row['payload'] = json.loads(row['payload'])
+    return list(rows)
+
+
+def get_job(jobID: int):
+    cur = mysql.connection.cursor()
+    cur.execute(f"SELECT {_JOB_COLUMNS} FROM Job WHERE jobID = %s", (jobID,))
+    row = cur.fetchone()
+    cur.close()
+    if row:
+        row['payload'] = json.loads(row['payload'])
+    return row
+
+
+def purge_jobs(olderThanDays: int):
+    cur = mysql.connection.cursor()
+    cur.execute("""
+        DELETE FROM Job
+        WHERE status = 'done' AND finishedAt < NOW(6) - INTERVAL %s DAY
+    """, (olderThanDays,))
+    count = cur.rowcount
+    mysql.connection.commit()
+    cur.close()
+    return count
+
+
+# Server-side sessions (see project/sessions.py). The cookie only holds the
+# opaque sessionID; userID is indexed so all sessions of a user can be revoked
+# with one statement.
+
+def load_session(sessionID: str):
+    """Return (data, expiresAt, userID) of an unexpired session, or None."""
+    cur = mysql.connection.cursor()
+    cur.execute("""
+        SELECT data, expiresAt, userID
+        FROM Session
+        WHERE sessionID = %s AND expiresAt > NOW()
+    """, (sessionID,))
+    row = cur.fetchone()
+    cur.close()
+    return (row['data'], row['expiresAt'], row['userID']) if row else None
+
+
+def save_session(sessionID: str, userID, data: str, expiresAt):
+    cur = mysql.connection.cursor()
+    cur.execute("""
+        INSERT INTO Session (sessionID, userID, data, expiresAt)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            userID = VALUES(userID),
+            data = VALUES(data),
+            expiresAt = VALUES(expiresAt)
+    """, (sessionID, userID, data, expiresAt))
+    mysql.connection.commit()
+    cur.close()
+
+
+def delete_session(sessionID: str):
+    cur = mysql.connection.cursor()
+    cur.execute("DELETE FROM Session WHERE sessionID = %s", (sessionID,))
+    mysql.connection.commit()
+    cur.close()
+
+
+def delete_user_sessions(userID: str):
+    cur = mysql.connection.cursor()
+    cur.execute("DELETE FROM Session WHERE userID = %s", (userID,))
+    count = cur.rowcount
+    mysql.connection.commit()
+    cur.close()
+    return count
+
+
+def purge_sessions():
+    cur = mysql.connection.cursor()
+    cur.execute("DELETE FROM Session WHERE expiresAt <= NOW()")
+    count = cur.rowcount
+    mysql.connection.commit()
+    cur.close()
+    return count
+
+
+# Bulk import (flask import-data, see project/bulkload.py)
+
+def bulk_insert(batches):
+    """Write (table, columns, keyColumns, rows) batches in one transaction.
+
+    Each batch is sent as multi-row INSERTs. Rows whose key already exists are
+    overwritten, so replaying a chunk after an interrupted import is harmless.
+    """
+    cur = mysql.connection.cursor()
+    try:
+        for table, columns, keyColumns, rows in batches:
+            if not rows:
+                continue
+            update = ', '.join(f'{column} = VALUES({column})'
+                               for column in columns if column not in keyColumns)
+            cur.executemany(f"""
+                INSERT INTO {table} ({', '.join(columns)})
+                VALUES ({_placeholders(columns)})
+                ON DUPLICATE KEY UPDATE {update or f'{keyColumns[0]} = {keyColumns[0]}'}
+            """, rows)
+        mysql.connection.commit()
+    except Exception as e:
+        print("Error bulk inserting:", e)
+        mysql.connection.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def get_image_prices(imageIDs):
+    """Return {imageID: (price, currency)} for the given images."""
+    if not imageIDs:
+        return {}
+    cur = mysql.connection.cursor()
+    cur.execute(f"""
+        SELECT imageID, price, currency FROM Image
+        WHERE imageID IN ({_placeholders(imageIDs)})
+    """, list(imageIDs))
+    rows = cur.fetchall()
+    cur.close()
+    return {row['imageID']: (row['price'], row['currency']) for row in rows}
+
+
+def finish_bulk_import(purchases: bool):
+    """Refresh derived data after an import and retire cached pages everywhere."""
+    cur = mysql.connection.cursor()
+    try:
+        if purchases:
+            cur.execute("""
+                UPDATE Image AS i
+                LEFT JOIN (
+                    SELECT imageID, COUNT(*) AS sold FROM PurchaseImage GROUP BY imageID
+                ) AS s ON s.imageID = i.imageID
+                SET i.quantity = COALESCE(s.sold, 0)
+            """)
+        # imported images and categories skip the per-write order sync
+        _sync_image_category_order(cur)
+        _bump_cache_version(cur, 'catalog')
+        _bump_cache_version(cur, 'categories')
+        if purchases:
+            _bump_cache_version(cur, 'sales')
+        mysql.connection.commit()
+    except Exception as e:
+        print("Error finishing bulk import:", e)
+        mysql.connection.rollback()
+        raise
+    finally:
+        cur.close()
+    _forget_cache_version('catalog')
+    _forget_cache_version('categories')
+    _forget_cache_version('sales')
@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from wtforms.fields import SubmitField, StringField, PasswordField, TextAreaField, RadioField, DecimalField, SelectField, FileField, SelectMultipleField
+from wtforms.fields import SubmitField, StringField, PasswordField, TextAreaField, RadioField, DecimalField, SelectField, FileField, SelectMultipleField, HiddenField
 from wtforms.validators import InputRequired, email
 from project.models import Currency, Role, ImageStatus
 from wtforms.widgets import ListWidget, CheckboxInput
@@ -74,6 +74,8 @@ class CheckoutFormPayment(FlaskForm):
     #     InputRequired(),
     #     Regexp(r"^\d{3}$", message="CVV must be 3 digits")
     # ])
+    # one token per rendered form, so a double submit only buys once
+    checkoutToken = HiddenField(validators=[InputRequired()])
     submit = SubmitField("Complete Payment")
     
     
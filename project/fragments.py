@@ -0,0 +1,62 @@
+from dataclasses import dataclass, field
+
+from flask import current_app, get_template_attribute, render_template
+from markupsafe import Markup
+
+from project.cache import Cache
+
+GRID_TEMPLATE = '_gallery_grid.html'
+
+
+@dataclass
+class GalleryFragment:
+    """Rendered card grid of one gallery page plus what the view needs around it."""
+    html: str
+    image_count: int
+    has_more: bool
+    first: tuple = None  # (updateDate, imageID) of the first card
+    last: tuple = None   # (updateDate, imageID) of the last card
+    owners: dict = field(default_factory=dict)   # imageID -> vendor userID
+    actions: dict = field(default_factory=dict)  # imageID -> (buy html, owned html)
+
+    def __len__(self):
+        # approximate memory footprint, used by the byte-bounded cache
+        return len(self.html) + sum(len(a) + len(b) for a, b in self.actions.values())
+
+
+_fragment_cache = None
+
+
+def get_fragment_cache():
+    global _fragment_cache
+    if _fragment_cache is None:
+        _fragment_cache = Cache(
+            maxsize=4096,
+            ttl=current_app.config.get('GALLERY_FRAGMENT_TTL', 600),
+            maxbytes=current_app.config.get('GALLERY_FRAGMENT_CACHE_BYTES', 8 * 1024 * 1024))
+    return _fragment_cache
+
+
+def render_gallery_fragment(images, has_more):
+    card_action = get_template_attribute(GRID_TEMPLATE, 'card_action')
+    return GalleryFragment(
+        html=render_template(GRID_TEMPLATE, images=images),
+        image_count=len(images),
+        has_more=has_more,
+        first=(images[0]['updateDate'], images[0]['imageID']) if images else None,
+        last=(images[-1]['updateDate'], images[-1]['imageID']) if images else None,
+        owners={img['imageID']: img['userID'] for img in images},
+        actions={img['imageID']: (str(card_action(img, False)), str(card_action(img, True)))
+                 for img in images},
+    )
+
+
+def apply_user_overlay(fragment, boughtIDImages, userID):
+    """Fill in the per-user Download / Add to cart buttons of a cached grid."""
+    marker = get_template_attribute(GRID_TEMPLATE, 'action_marker')
+    html = fragment.html
+    for imageID, ownerID in fragment.owners.items():
+        owned = imageID in boughtIDImages or (userID is not None and ownerID == userID)
+        html = html.replace(str(marker(imageID)),
+                            fragment.actions[imageID][owned], 1)
+    return Markup(html)
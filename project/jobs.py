@@ -0,0 +1,182 @@
+import os
+import random
+import socket
+import threading
+import traceback
+
+import click
+from flask import current_app, g
+
+from project import db
+
+# kind -> function called with the job payload as keyword arguments
+_handlers = {}
+_workers = []
+_workers_lock = threading.Lock()
+# set when this process queues a job, so idle workers pick it up without polling
+_wakeup = threading.Event()
+
+
+def handler(kind: str):
+    """Register the function that runs jobs of this kind."""
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind: str, payload=None, dedupeKey: str = None, delay: float = 0,
+            maxAttempts: int = None, cur=None):
+    """Queue a job to run after the current request. See db.enqueue_job."""
+    if maxAttempts is None:
+        maxAttempts = current_app.config['JOB_MAX_ATTEMPTS']
+    jobID = db.enqueue_job(kind, payload, dedupeKey, delay, maxAttempts, cur)
+    _wakeup.set()
+    return jobID
+
+
+def retry_delay(attempts: int, base: float, cap: float):
+    # exponential backoff with jitter, so failing jobs do not retry in lockstep
+    return min(cap, base * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+
+
+class JobWorker(threading.Thread):
+    """Polls the Job table and runs one job at a time inside an app context."""
+
+    def __init__(self, app, number: int):
+        super().__init__(daemon=True)
+        self.app = app
+        self.name = f'{socket.gethostname()}:{os.getpid()}:{number}'[:64]
+        self.stopping = threading.Event()
+        self.current = None
+        self.processed = 0
+        self.failed = 0
+
+    def run(self):
+        config = self.app.config
+        while not self.stopping.is_set():
+            try:
+                with self.app.app_context():
+                    ran = self.run_once()
+            except Exception as e:
+                # e.g. database unreachable: back off and keep the thread alive
+                print("Error in job worker:", e)
+                ran = False
+            if not ran:
+                _wakeup.wait(config['JOB_POLL_INTERVAL'])
+                _wakeup.clear()
+
+    def run_once(self):
+        job = db.claim_job(self.name)
+        if job is None:
+            return False
+        self.current = job['jobID']
+        try:
+            func = _handlers.get(job['kind'])
+            if func is None:
+                raise LookupError(f"No handler registered for job kind '{job['kind']}'")
+            func(**job['payload'])
+        except Exception:
+            self.failed += 1
+            # drop whatever the handler left uncommitted before recording the failure
+            if 'mysql_conn' in g:
+                g.mysql_conn.rollback()
+            retryIn = None
+            if job['attempts'] < job['maxAttempts']:
+                retryIn = retry_delay(job['attempts'], self.app.config['JOB_RETRY_BASE'],
+                                      self.app.config['JOB_RETRY_MAX'])
+            owned = db.fail_job(job['jobID'], self.name, traceback.format_exc()[-4000:], retryIn)
+        else:
+            owned = db.complete_job(job['jobID'], self.name)
+        finally:
+            self.processed += 1
+            self.current = None
+        # the lease expired and the job was requeued; its new owner records the outcome
+        if not owned:
+            print(f"Job {job['jobID']} lease expired before {self.name} finished it")
+        return True
+
+    def stop(self):
+        self.stopping.set()
+        _wakeup.set()
+
+
+class LeaseReaper(threading.Thread):
+    """Requeues jobs left 'running' by a worker process that died."""
+
+    def __init__(self, app):
+        super().__init__(daemon=True)
+        self.app = app
+        self.stopping = threading.Event()
+
+    def run(self):
+        lease = self.app.config['JOB_LEASE_SECONDS']
+        while not self.stopping.wait(lease / 2):
+            try:
+                with self.app.app_context():
+                    db.requeue_stale_jobs(lease)
+            except Exception as e:
+                print("Error requeueing stale jobs:", e)
+
+    def stop(self):
+        self.stopping.set()
+
+
+def start_workers(app, count: int = None):
+    """Start the worker threads of this process once; later calls do nothing."""
+    count = app.config['JOB_WORKERS'] if count is None else count
+    with _workers_lock:
+        if _workers or count <= 0:
+            return _workers
+        _workers.append(LeaseReaper(app))
+        _workers.extend(JobWorker(app, number) for number in range(count))
+        for worker in _workers:
+            worker.start()
+    return _workers
+
+
+def stop_workers():
+    with _workers_lock:
+        for worker in _workers:
+            worker.stop()
+        _workers.clear()
+
+
+def worker_stats():
+    return [{
+        'name': worker.name,
+        'alive': worker.is_alive(),
+        'current': worker.current,
+        'processed': worker.processed,
+        'failed': worker.failed,
+    } for worker in _workers if isinstance(worker, JobWorker)]
+
+
+def init_app(app):
+    app.config.setdefault('JOB_WORKERS', 2)
+    app.config.setdefault('JOB_POLL_INTERVAL', 1.0)
+    app.config.setdefault('JOB_MAX_ATTEMPTS', 5)
+    app.config.setdefault('JOB_RETRY_BASE', 5.0)
+    app.config.setdefault('JOB_RETRY_MAX', 600.0)
+    app.config.setdefault('JOB_LEASE_SECONDS', 300)
+
+    # workers start with the first request, so CLI commands do not spawn them
+    @app.before_request
+    def ensure_workers():
+        if not _workers:
+            start_workers(app)
+
+    @app.cli.command('run-jobs')
+    @click.option('--workers', type=int, default=None, help='Number of worker threads.')
+    def run_jobs(workers):
+        """Run job workers in the foreground (for a dedicated worker process)."""
+        threads = start_workers(app, workers)
+        if not threads:
+            click.echo('No job workers configured', err=True)
+            return
+        click.echo(f'{len(threads) - 1} job worker(s) running, Ctrl+C to stop')
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            stop_workers()
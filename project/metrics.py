@@ -0,0 +1,218 @@
+import bisect
+import heapq
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, g, has_app_context, request
+
+# Prometheus histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+# statements kept per request for the slow query log
+SLOWEST_QUERIES = 5
+# pool stats that go up and down; the others only grow
+POOL_GAUGES = ('in_use', 'idle', 'max_size')
+
+_SPACE = re.compile(r'\s+')
+_IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+
+
+def query_shape(sql):
+    """Normalize a statement so the same query with other values has the same shape."""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    sql = _SPACE.sub(' ', sql).strip()
+    sql = _IN_LIST.sub('(...)', sql)
+    return _NUMBER.sub('?', sql)
+
+
+class QueryStats:
+    """Statements run while handling one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+        self._slowest = []  # min-heap of (seconds, shape)
+
+    def record(self, sql, seconds):
+        shape = query_shape(sql)
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[shape] += 1
+        if len(self._slowest) < SLOWEST_QUERIES:
+            heapq.heappush(self._slowest, (seconds, shape))
+        elif seconds > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, (seconds, shape))
+
+    def slowest(self):
+        return sorted(self._slowest, reverse=True)
+
+    def repeated(self, threshold):
+        # the same statement shape run many times is usually a query in a loop (N+1)
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+
+def _record(sql, seconds):
+    if has_app_context():
+        stats = g.get('query_stats')
+        if stats is not None:
+            stats.record(sql, seconds)
+
+
+class InstrumentedCursorMixin:
+    """Times execute/executemany and records them in the request's QueryStats."""
+    _in_executemany = False
+
+    def execute(self, query, args=None):
+        if self._in_executemany:
+            return super().execute(query, args)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            _record(query, time.perf_counter() - start)
+
+    def executemany(self, query, args):
+        # MySQLdb may call execute() once per row; count the batch as one statement
+        self._in_executemany = True
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, args)
+        finally:
+            self._in_executemany = False
+            _record(query, time.perf_counter() - start)
+
+
+_instrumented_classes = {}
+
+
+def instrumented(cursorclass):
+    """Return an instrumented subclass of a MySQLdb cursor class."""
+    if cursorclass not in _instrumented_classes:
+        _instrumented_classes[cursorclass] = type(
+            'Instrumented' + cursorclass.__name__, (InstrumentedCursorMixin, cursorclass), {})
+    return _instrumented_classes[cursorclass]
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum:.6f}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """Per-process request and database metrics, rendered in Prometheus text format."""
+
+    HISTOGRAMS = {
+        'photosite_request_duration_seconds': ('Request handling time', DURATION_BUCKETS),
+        'photosite_request_db_seconds': ('Time spent in SQL statements per request', DURATION_BUCKETS),
+        'photosite_request_db_queries': ('SQL statements per request', QUERY_COUNT_BUCKETS),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {name: {} for name in self.HISTOGRAMS}
+        self._responses = Counter()     # (endpoint, status) -> requests
+        self._n_plus_one = Counter()    # endpoint -> flagged requests
+
+    def observe_request(self, endpoint, status, seconds, stats, flagged):
+        values = {
+            'photosite_request_duration_seconds': seconds,
+            'photosite_request_db_seconds': stats.seconds,
+            'photosite_request_db_queries': stats.count,
+        }
+        with self._lock:
+            for name, value in values.items():
+                histogram = self._histograms[name].get(endpoint)
+                if histogram is None:
+                    histogram = self._histograms[name][endpoint] = Histogram(self.HISTOGRAMS[name][1])
+                histogram.observe(value)
+            self._responses[(endpoint, status)] += 1
+            if flagged:
+                self._n_plus_one[endpoint] += 1
+
+    def render(self, pool_stats=None):
+        lines = []
+        with self._lock:
+            for name, (description, _) in self.HISTOGRAMS.items():
+                lines += [f'# HELP {name} {description}', f'# TYPE {name} histogram']
+                for endpoint, histogram in sorted(self._histograms[name].items()):
+                    lines.extend(histogram.lines(name, f'endpoint="{_label(endpoint)}"'))
+            lines += ['# HELP photosite_requests_total Requests by endpoint and status',
+                      '# TYPE photosite_requests_total counter']
+            for (endpoint, status), count in sorted(self._responses.items()):
+                lines.append(f'photosite_requests_total{{endpoint="{_label(endpoint)}",status="{status}"}} {count}')
+            lines += ['# HELP photosite_n_plus_one_total Requests flagged for repeated query shapes',
+                      '# TYPE photosite_n_plus_one_total counter']
+            for endpoint, count in sorted(self._n_plus_one.items()):
+                lines.append(f'photosite_n_plus_one_total{{endpoint="{_label(endpoint)}"}} {count}')
+        for key, value in sorted((pool_stats or {}).items()):
+            name = f'photosite_db_pool_{key}'
+            kind = 'gauge' if key in POOL_GAUGES else 'counter'
+            lines += [f'# TYPE {name} {kind}', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+def get_metrics():
+    return current_app.extensions['metrics']
+
+
+def init_app(app):
+    app.config.setdefault('N_PLUS_ONE_THRESHOLD', 10)
+    app.config.setdefault('SLOW_REQUEST_DB_SECONDS', 0.5)
+    app.config.setdefault('METRICS_TOKEN', None)
+    app.extensions['metrics'] = Metrics()
+
+    @app.before_request
+    def start_query_stats():
+        g.query_stats = QueryStats()
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def add_server_timing(response):
+        stats = g.get('query_stats')
+        if stats is not None:
+            response.headers.add('Server-Timing',
+                                 f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries"')
+            g.response_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request(exception):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return
+        endpoint = request.endpoint or 'unmatched'
+        seconds = time.perf_counter() - g.pop('request_started')
+        repeated = stats.repeated(app.config['N_PLUS_ONE_THRESHOLD'])
+        for shape, count in repeated:
+            app.logger.warning('Possible N+1 in %s: %d x %s', endpoint, count, shape)
+        if stats.seconds >= app.config['SLOW_REQUEST_DB_SECONDS']:
+            app.logger.warning('Slow DB time in %s: %d queries, %.3fs; slowest: %s', endpoint,
+                               stats.count, stats.seconds,
+                               '; '.join(f'{s:.3f}s {shape[:200]}' for s, shape in stats.slowest()))
+        status = g.pop('response_status', 500)
+        app.extensions['metrics'].observe_request(endpoint, status, seconds, stats, bool(repeated))
@@ -52,8 +52,15 @@ class Image:
     imageStatus: ImageStatus = ImageStatus.ACTIVE
     updateDate: datetime = field(default_factory=lambda: datetime.now())
     listRatings: List[Rating] = field(default_factory=lambda: [])
+    # materialized from RatingSummary, so listings do not need every Rating row
+    ratingCount: int = 0
+    ratingSum: int = 0
+    ratingHistogram: List[int] = field(default_factory=lambda: [0] * 6)  # count per score 0..5
+    blobHash: str = None  # SHA-256 of the stored file (ImageBlob)
 
     def get_average_rating(self):
+        if self.ratingCount:
+            return self.ratingSum / self.ratingCount
         if not self.listRatings:
             return 0.0
         return sum(rating.score for rating in self.listRatings) / len(self.listRatings)
@@ -62,6 +69,22 @@ class Image:
         return self.price*self.quantity
 
 
+@dataclass
+class CartLine:
+    # just what the cart and checkout pages show for an image
+    imageID: str
+    title: str
+    price: float
+    currency: str
+    extension: str
+
+
+@dataclass
+class CartSummary:
+    count: int = 0
+    totals: dict = field(default_factory=dict)  # currency -> total price
+
+
 class Role(Enum):
     ADMIN = 'Admin'
     CUSTOMER = 'Customer'
@@ -0,0 +1,291 @@
+import itertools
+import queue
+import threading
+import time
+
+import MySQLdb
+import MySQLdb.connections
+import MySQLdb.cursors
+from flask import current_app, g, has_app_context, session
+
+from project.metrics import instrumented
+
+
+# session key: until this time.time() the user's reads go to the primary
+READ_PRIMARY_KEY = '_read_primary_until'
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes free within the checkout timeout."""
+
+
+class Connection(MySQLdb.connections.Connection):
+    """MySQLdb connection that notes commits, for read-your-writes routing."""
+
+    def commit(self):
+        super().commit()
+        if has_app_context():
+            g.mysql_committed = True
+
+
+class ConnectionPool:
+    """Bounded pool of MySQLdb connections.
+
+    Idle connections are pinged before reuse (pre-ping) and closed once they
+    are older than `recycle` seconds, so connections dropped by the server
+    (wait_timeout) are never handed to a request.
+    """
+
+    def __init__(self, connect_kwargs, max_size=10, timeout=10.0, recycle=3600, pre_ping=True):
+        self.connect_kwargs = connect_kwargs
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        # replicas that fail to connect are skipped until then (time.monotonic())
+        self.unavailable_until = 0.0
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._stats = {
+            'in_use': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'created': 0,
+            'closed': 0,
+            'recycled': 0,
+            'stale': 0,
+        }
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def _connect(self):
+        conn = Connection(**self.connect_kwargs)
+        conn._pool_created = time.monotonic()
+        self._count('created')
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except MySQLdb.Error:
+            pass
+        self._count('closed')
+
+    def _get_idle_or_new(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if self.recycle and time.monotonic() - conn._pool_created > self.recycle:
+                self._close(conn)
+                self._count('recycled')
+                continue
+            if self.pre_ping:
+                try:
+                    conn.ping()
+                except MySQLdb.Error:
+                    self._close(conn)
+                    self._count('stale')
+                    continue
+            return conn
+
+    def acquire(self):
+        start = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            # pool exhausted: wait for a connection to be released
+            self._count('waits')
+            acquired = self._slots.acquire(timeout=self.timeout)
+            self._count('wait_time', time.monotonic() - start)
+            if not acquired:
+                self._count('timeouts')
+                raise PoolTimeout(
+                    f'No MySQL connection available after {self.timeout}s '
+                    f'(pool size {self.max_size})')
+        try:
+            conn = self._get_idle_or_new()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._stats['in_use'] += 1
+            self._stats['checkouts'] += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        try:
+            if not discard:
+                try:
+                    # never hand out a connection in the middle of a transaction
+                    conn.rollback()
+                except MySQLdb.Error:
+                    discard = True
+            if discard:
+                self._close(conn)
+            else:
+                self._idle.put(conn)
+        finally:
+            self._count('in_use', -1)
+            self._slots.release()
+
+    def dispose(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['max_size'] = self.max_size
+        stats['idle'] = self._idle.qsize()
+        stats['wait_time'] = round(stats['wait_time'], 4)
+        return stats
+
+
+class MySQL:
+    """Flask glue: one pooled connection per app context, returned at teardown.
+
+    Keeps the `mysql.connection` interface of flask_mysqldb, so db.py code is
+    unchanged. With MYSQL_REPLICAS set, `mysql.reader` gives read-only queries
+    a replica connection instead. Reads stay on the primary after a commit in
+    the same app context, and for MYSQL_READ_YOUR_WRITES_SECONDS in the
+    session that committed, so users see their own writes despite
+    replication lag.
+    """
+
+    def __init__(self, app=None):
+        self._replica_turn = itertools.count()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MYSQL_HOST', 'localhost')
+        app.config.setdefault('MYSQL_PORT', 3306)
+        app.config.setdefault('MYSQL_USER', None)
+        app.config.setdefault('MYSQL_PASSWORD', None)
+        app.config.setdefault('MYSQL_DB', None)
+        app.config.setdefault('MYSQL_CHARSET', 'utf8mb4')
+        app.config.setdefault('MYSQL_CURSORCLASS', None)
+        app.config.setdefault('MYSQL_CONNECT_TIMEOUT', 10)
+        app.config.setdefault('MYSQL_POOL_SIZE', 10)
+        app.config.setdefault('MYSQL_POOL_TIMEOUT', 10.0)
+        app.config.setdefault('MYSQL_POOL_RECYCLE', 3600)
+        app.config.setdefault('MYSQL_POOL_PRE_PING', True)
+        # time every statement for the per-request stats and /metrics
+        app.config.setdefault('MYSQL_INSTRUMENT', True)
+        # read replicas, e.g. [{'host': 'replica1'}, {'host': '127.0.0.1', 'port': 3307}];
+        # keys override the matching MYSQL_* setting of the primary
+        app.config.setdefault('MYSQL_REPLICAS', [])
+        app.config.setdefault('MYSQL_READ_YOUR_WRITES_SECONDS', 10)
+        app.config.setdefault('MYSQL_REPLICA_RETRY', 30)
+
+        self.create_pools(app)
+        app.before_request(self._pin_reads)
+        app.after_request(self._remember_write)
+        app.teardown_appcontext(self.teardown)
+
+    def create_pools(self, app):
+        app.extensions['mysql_pool'] = self.create_pool(app.config)
+        app.extensions['mysql_replica_pools'] = [
+            self.create_pool({**app.config, **{f'MYSQL_{key.upper()}': value for key, value in replica.items()}})
+            for replica in app.config['MYSQL_REPLICAS']
+        ]
+
+    @staticmethod
+    def connect_kwargs(config):
+        kwargs = {
+            'host': config['MYSQL_HOST'],
+            'port': config['MYSQL_PORT'],
+            'charset': config['MYSQL_CHARSET'],
+            'connect_timeout': config['MYSQL_CONNECT_TIMEOUT'],
+        }
+        if config['MYSQL_USER']:
+            kwargs['user'] = config['MYSQL_USER']
+        if config['MYSQL_PASSWORD']:
+            kwargs['passwd'] = config['MYSQL_PASSWORD']
+        if config['MYSQL_DB']:
+            kwargs['db'] = config['MYSQL_DB']
+        cursorclass = getattr(MySQLdb.cursors, config['MYSQL_CURSORCLASS'] or 'Cursor')
+        if config['MYSQL_INSTRUMENT']:
+            cursorclass = instrumented(cursorclass)
+        kwargs['cursorclass'] = cursorclass
+        return kwargs
+
+    def create_pool(self, config):
+        return ConnectionPool(
+            self.connect_kwargs(config),
+            max_size=config['MYSQL_POOL_SIZE'],
+            timeout=config['MYSQL_POOL_TIMEOUT'],
+            recycle=config['MYSQL_POOL_RECYCLE'],
+            pre_ping=config['MYSQL_POOL_PRE_PING'],
+        )
+
+    @property
+    def pool(self):
+        return current_app.extensions['mysql_pool']
+
+    @property
+    def replica_pools(self):
+        return current_app.extensions['mysql_replica_pools']
+
+    @property
+    def connection(self):
+        if 'mysql_conn' not in g:
+            g.mysql_conn = self.pool.acquire()
+        return g.mysql_conn
+
+    @property
+    def reader(self):
+        """Connection for read-only queries: a replica when one is usable, else the primary."""
+        if not self.replica_pools or g.get('mysql_read_primary') or g.get('mysql_committed'):
+            return self.connection
+        if 'mysql_reader' not in g:
+            reader = self._acquire_replica()
+            if reader is None:
+                return self.connection
+            g.mysql_reader = reader
+        return g.mysql_reader[1]
+
+    def _acquire_replica(self):
+        # round robin, skipping replicas that recently failed to connect
+        pools = self.replica_pools
+        first = next(self._replica_turn)
+        for i in range(len(pools)):
+            pool = pools[(first + i) % len(pools)]
+            if pool.unavailable_until > time.monotonic():
+                continue
+            try:
+                return pool, pool.acquire()
+            except (MySQLdb.Error, PoolTimeout) as e:
+                print("Error connecting to replica:", e)
+                pool.unavailable_until = time.monotonic() + current_app.config['MYSQL_REPLICA_RETRY']
+        return None
+
+    def replica_stats(self):
+        return [dict(pool.stats(), host=pool.connect_kwargs['host'], port=pool.connect_kwargs['port'],
+                     available=pool.unavailable_until <= time.monotonic())
+                for pool in self.replica_pools]
+
+    def _pin_reads(self):
+        if self.replica_pools and session.get(READ_PRIMARY_KEY, 0) > time.time():
+            g.mysql_read_primary = True
+
+    def _remember_write(self, response):
+        if self.replica_pools and g.get('mysql_committed'):
+            session[READ_PRIMARY_KEY] = time.time() + current_app.config['MYSQL_READ_YOUR_WRITES_SECONDS']
+        return response
+
+    def teardown(self, exception):
+        conn = g.pop('mysql_conn', None)
+        if conn is not None:
+            self.pool.release(conn)
+        reader = g.pop('mysql_reader', None)
+        if reader is not None:
+            reader[0].release(reader[1])
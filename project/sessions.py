@@ -0,0 +1,218 @@
+import secrets
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+
+from project import db
+from project.cache import Cache
+
+# token_urlsafe(32) gives a 43 character ID with 256 random bits
+SESSION_ID_BYTES = 32
+SESSION_ID_MAX_LENGTH = 64
+
+
+class ServerSideSession(SecureCookieSession):
+    """Session whose data lives in a SessionStore; the cookie only holds `sid`."""
+
+    def __init__(self, initial=None, sid=None, expiresAt=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.expiresAt = expiresAt
+        self.previous_sid = None
+
+    @property
+    def new(self):
+        return self.sid is None
+
+    def regenerate(self):
+        """Keep the data under a fresh session ID (on login, against session fixation)."""
+        if self.sid:
+            self.previous_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+
+class MemorySessionStore:
+    """Sessions in a dict of this process; for development and tests."""
+
+    def __init__(self):
+        self._sessions = {}  # sid -> (data, expiresAt, userID)
+        self._by_user = {}   # userID -> set of sid
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._sessions.get(sid)
+        if entry is None or entry[1] <= datetime.now():
+            return None
+        return entry
+
+    def save(self, sid, userID, data, expiresAt):
+        with self._lock:
+            self._discard(sid)
+            self._sessions[sid] = (data, expiresAt, userID)
+            if userID:
+                self._by_user.setdefault(userID, set()).add(sid)
+
+    def _discard(self, sid):
+        entry = self._sessions.pop(sid, None)
+        if entry and entry[2]:
+            self._by_user.get(entry[2], set()).discard(sid)
+
+    def delete(self, sid):
+        with self._lock:
+            self._discard(sid)
+
+    def revoke_user(self, userID):
+        with self._lock:
+            sids = self._by_user.pop(userID, set())
+            for sid in sids:
+                self._sessions.pop(sid, None)
+        return len(sids)
+
+
+class MySQLSessionStore:
+    """Sessions in the Session table, shared by every process."""
+
+    def load(self, sid):
+        return db.load_session(sid)
+
+    def save(self, sid, userID, data, expiresAt):
+        db.save_session(sid, userID, data, expiresAt)
+
+    def delete(self, sid):
+        db.delete_session(sid)
+
+    def revoke_user(self, userID):
+        return db.delete_user_sessions(userID)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface backed by a store plus a local read-through cache.
+
+    The cache keeps serialized sessions for `cache_ttl` seconds, so most
+    requests do not query the store. Revocations in this process take effect
+    at once; other processes drop their cached copy within `cache_ttl`.
+    """
+    serializer = TaggedJSONSerializer()
+    session_class = ServerSideSession
+
+    def __init__(self, store, cache_ttl=5.0, cache_size=10000):
+        self.store = store
+        self.cache = Cache(maxsize=cache_size, ttl=cache_ttl) if cache_ttl else None
+        # userID -> time.monotonic() of the last revocation in this process
+        self._revoked = Cache(maxsize=cache_size, ttl=cache_ttl or 1)
+
+    def _load(self, sid):
+        if self.cache is not None:
+            entry = self.cache.get(sid)
+            if entry is not None:
+                data, expiresAt, userID, loadedAt = entry
+                revokedAt = self._revoked.get(userID) if userID else None
+                if (revokedAt is None or loadedAt > revokedAt) and expiresAt > datetime.now():
+                    return data, expiresAt
+                self.cache.delete(sid)
+        loaded = self.store.load(sid)
+        if loaded is None:
+            return None
+        data, expiresAt, userID = loaded
+        self._remember(sid, data, expiresAt, userID)
+        return data, expiresAt
+
+    def _remember(self, sid, data, expiresAt, userID):
+        if self.cache is not None:
+            self.cache.set(sid, (data, expiresAt, userID, time.monotonic()))
+
+    def _delete(self, sid):
+        self.store.delete(sid)
+        if self.cache is not None:
+            self.cache.delete(sid)
+
+    def revoke_user(self, userID):
+        """End every session of a user; one indexed delete in the store."""
+        count = self.store.revoke_user(userID)
+        self._revoked.set(userID, time.monotonic())
+        return count
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and len(sid) <= SESSION_ID_MAX_LENGTH:
+            loaded = self._load(sid)
+            if loaded is not None:
+                data, expiresAt = loaded
+                return self.session_class(self.serializer.loads(data), sid, expiresAt)
+        return self.session_class()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+        if session.previous_sid:
+            self._delete(session.previous_sid)
+
+        if not session:
+            # emptied (e.g. logout): drop the stored data and the cookie
+            if session.sid and session.modified:
+                self._delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+            return
+
+        now = datetime.now()
+        lifetime = app.permanent_session_lifetime
+        # sliding expiry without a write per request: extend once half is used up
+        refresh = session.expiresAt is None or session.expiresAt - now < lifetime / 2
+        if not (session.modified or refresh):
+            return
+
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(SESSION_ID_BYTES)
+        expiresAt = (now + lifetime).replace(microsecond=0)
+        data = self.serializer.dumps(dict(session))
+        userID = (session.get('user') or {}).get('userID')
+        self.store.save(session.sid, userID, data, expiresAt)
+        self._remember(session.sid, data, expiresAt, userID)
+        session.expiresAt = expiresAt
+
+        response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                            httponly=httponly, domain=domain, path=path, secure=secure,
+                            samesite=samesite)
+
+
+SESSION_STORES = {
+    'memory': MemorySessionStore,
+    'mysql': MySQLSessionStore,
+}
+
+
+def regenerate_session():
+    if isinstance(session, ServerSideSession):
+        session.regenerate()
+
+
+def revoke_user_sessions(userID: str):
+    """Log a user out everywhere. Returns the number of sessions ended."""
+    interface = current_app.session_interface
+    if isinstance(interface, ServerSideSessionInterface):
+        return interface.revoke_user(userID)
+    return 0
+
+
+def init_app(app):
+    # 'cookie' keeps Flask's signed cookie sessions
+    backend = app.config.setdefault('SESSION_BACKEND', 'mysql')
+    app.config.setdefault('SESSION_LOCAL_CACHE_TTL', 5.0)
+    if backend == 'cookie':
+        return
+    app.session_interface = ServerSideSessionInterface(
+        SESSION_STORES[backend](), cache_ttl=app.config['SESSION_LOCAL_CACHE_TTL'])
@@ -0,0 +1,180 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+from flask import current_app, url_for
+from PIL import Image as PILImage, ImageOps
+
+from project import db, jobs
+from project.cache import Cache
+from project.uploads import link_file
+from project.utils import ALLOWED_EXTENSIONS
+
+# Derivatives are written next to the originals, in a sub folder
+DERIVATIVE_FOLDER = 'derivatives'
+
+# name -> target width in pixels (never upscaled)
+DERIVATIVE_SIZES = {
+    'thumb': 320,
+    'card': 640,
+    'hero': 1600,
+}
+
+# file extension -> Pillow format name
+DERIVATIVE_FORMATS = {
+    'webp': 'WEBP',
+    'jpg': 'JPEG',
+}
+
+_executor = None
+# derivatives never change once written, so remember the widths we have read
+_derivative_widths = Cache(maxsize=4096)
+
+
+def derivative_filename(imageID: str, size: str, fmt: str):
+    return f'{imageID}-{size}.{fmt}'
+
+
+def widths_filename(imageID: str):
+    # {size: output width} of the distinct derivatives, written after all of them
+    return f'{imageID}-widths.json'
+
+
+def derivative_folder(upload_folder: str):
+    return os.path.join(upload_folder, DERIVATIVE_FOLDER)
+
+
+def generate_derivatives(source_path: str, dest_folder: str, imageID: str):
+    """Write every size/format derivative of one original. Runs in a worker process."""
+    os.makedirs(dest_folder, exist_ok=True)
+    written = []
+    widths = {}
+    with PILImage.open(source_path) as original:
+        original = ImageOps.exif_transpose(original)
+        for size, width in DERIVATIVE_SIZES.items():
+            resized = original
+            if original.width > width:
+                height = round(original.height * width / original.width)
+                resized = original.resize(
+                    (width, height), PILImage.Resampling.LANCZOS)
+            # sizes clamped to the original's width repeat a smaller one
+            if resized.width not in widths.values():
+                widths[size] = resized.width
+            for fmt, pil_format in DERIVATIVE_FORMATS.items():
+                image = resized
+                if pil_format == 'JPEG' and image.mode != 'RGB':
+                    image = image.convert('RGB')
+                elif image.mode not in ('RGB', 'RGBA'):
+                    image = image.convert('RGBA')
+                dest = os.path.join(
+                    dest_folder, derivative_filename(imageID, size, fmt))
+                # write to a temp file first so readers never see half a file
+                tmp = dest + '.tmp'
+                image.save(tmp, pil_format, quality=82, optimize=True)
+                os.replace(tmp, dest)
+                written.append(dest)
+    dest = os.path.join(dest_folder, widths_filename(imageID))
+    with open(dest + '.tmp', 'w') as f:
+        json.dump(widths, f)
+    os.replace(dest + '.tmp', dest)
+    written.append(dest)
+    return written
+
+
+def has_derivatives(upload_folder: str, imageID: str):
+    folder = derivative_folder(upload_folder)
+    return os.path.exists(os.path.join(folder, widths_filename(imageID))) and all(
+        os.path.exists(os.path.join(folder, derivative_filename(imageID, size, fmt)))
+        for size in DERIVATIVE_SIZES for fmt in DERIVATIVE_FORMATS)
+
+
+def link_derivatives(upload_folder: str, fromID: str, toID: str):
+    """Reuse the derivatives of an identical upload via hard links. False if any are missing."""
+    if not has_derivatives(upload_folder, fromID):
+        return False
+    folder = derivative_folder(upload_folder)
+    for size in DERIVATIVE_SIZES:
+        for fmt in DERIVATIVE_FORMATS:
+            link_file(os.path.join(folder, derivative_filename(fromID, size, fmt)),
+                      os.path.join(folder, derivative_filename(toID, size, fmt)))
+    link_file(os.path.join(folder, widths_filename(fromID)), os.path.join(folder, widths_filename(toID)))
+    return True
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=current_app.config.get('DERIVATIVE_WORKERS', 2))
+    return _executor
+
+
+@jobs.handler('derivatives')
+def build_derivatives(imageID: str, extension: str):
+    # the resizing itself runs in a worker process, off this process's GIL
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    source_path = os.path.join(upload_folder, imageID + extension)
+    get_executor().submit(
+        generate_derivatives, source_path, derivative_folder(upload_folder), imageID).result()
+    # cached gallery cards were rendered without a srcset
+    db.bump_cache_version('catalog')
+
+
+def schedule_derivatives(imageID: str, extension: str):
+    """Queue derivative generation for a freshly saved upload without blocking the request."""
+    return jobs.enqueue('derivatives', {'imageID': imageID, 'extension': extension},
+                        dedupeKey=f'derivatives:{imageID}')
+
+
+def derivative_widths(imageID: str):
+    """Return {size: output width} of an image's distinct derivatives ({} if none yet)."""
+    widths = _derivative_widths.get(imageID)
+    if widths is None:
+        path = os.path.join(derivative_folder(current_app.config['UPLOAD_FOLDER']), widths_filename(imageID))
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            widths = json.load(f)
+        _derivative_widths.set(imageID, widths)
+    return widths
+
+
+def image_srcset(imageID: str, fmt: str):
+    """Build a srcset value from the derivatives that exist for an image ('' if none yet)."""
+    candidates = []
+    for size, width in derivative_widths(imageID).items():
+        url = url_for('main.media', filename=f'{DERIVATIVE_FOLDER}/{derivative_filename(imageID, size, fmt)}')
+        candidates.append(f'{url} {width}w')
+    return ', '.join(candidates)
+
+
+def init_app(app):
+    app.jinja_env.globals['image_srcset'] = image_srcset
+
+    @app.cli.command('backfill-derivatives')
+    @click.option('--force', is_flag=True, help='Regenerate derivatives that already exist.')
+    def backfill_derivatives(force):
+        """Generate thumbnail/card/hero derivatives for existing uploads."""
+        upload_folder = app.config['UPLOAD_FOLDER']
+        queued = []
+        for filename in sorted(os.listdir(upload_folder)):
+            imageID, extension = os.path.splitext(filename)
+            if extension.lstrip('.').lower() not in ALLOWED_EXTENSIONS:
+                continue
+            if not force and has_derivatives(upload_folder, imageID):
+                continue
+            queued.append((os.path.join(upload_folder, filename), imageID))
+
+        click.echo(f'{len(queued)} image(s) to process')
+        with ProcessPoolExecutor(max_workers=app.config.get('DERIVATIVE_WORKERS', 2)) as pool:
+            futures = [pool.submit(generate_derivatives, path, derivative_folder(upload_folder), imageID)
+                       for path, imageID in queued]
+            for done, (future, (path, imageID)) in enumerate(zip(futures, queued), start=1):
+                try:
+                    future.result()
+                    click.echo(f'[{done}/{len(queued)}] {imageID}')
+                except Exception as e:
+                    click.echo(f'[{done}/{len(queued)}] {imageID} failed: {e}', err=True)
+        if queued:
+            db.bump_cache_version('catalog')
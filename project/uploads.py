@@ -0,0 +1,112 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass
+
+# Uploaded files are stored once per content hash under blobs/<2 chars>/<sha256>.
+# Each Image gets a hard link named imageID + extension, so identical uploads
+# share the same bytes on disk.
+BLOB_FOLDER = 'blobs'
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the configured maximum size."""
+
+
+@dataclass
+class StoredBlob:
+    sha256: str
+    size: int
+    path: str
+    is_new: bool
+
+
+def blob_path(upload_folder: str, sha256: str):
+    return os.path.join(upload_folder, BLOB_FOLDER, sha256[:2], sha256)
+
+
+def store_upload(file, upload_folder: str, max_bytes: int):
+    """Copy an uploaded file to the blob store in chunks, hashing as we go.
+
+    Werkzeug has already spooled the request body (to a temporary file for
+    anything but small uploads), so this reads that copy rather than the
+    socket; memory use stays at one chunk whatever the file size. If a blob
+    with the same SHA-256 already exists the new copy is discarded.
+    """
+    tmp_dir = os.path.join(upload_folder, BLOB_FOLDER, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(
+                        f'Upload is larger than {max_bytes} bytes')
+                digest.update(chunk)
+                out.write(chunk)
+
+        sha256 = digest.hexdigest()
+        path = blob_path(upload_folder, sha256)
+        if os.path.exists(path):
+            # reuse is recorded in ImageBlob.lastUsedAt; touching the file would
+            # change the mtime (and so the ETag) of every image linked to it
+            os.remove(tmp_path)
+            return StoredBlob(sha256, size, path, is_new=False)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return StoredBlob(sha256, size, path, is_new=True)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def link_file(source: str, dest: str):
+    """Hard link dest to source (no extra bytes); copy if linking is not possible."""
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copyfile(source, dest)
+
+
+def iter_blob_files(upload_folder: str):
+    """Yield (sha256, path) for every file in the blob store."""
+    root = os.path.join(upload_folder, BLOB_FOLDER)
+    if not os.path.isdir(root):
+        return
+    for prefix in sorted(os.listdir(root)):
+        folder = os.path.join(root, prefix)
+        if prefix == 'tmp' or not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            yield name, os.path.join(folder, name)
+
+
+def purge_blob_file(path: str, min_age: float):
+    """Remove a blob file unless it was written in the last min_age seconds."""
+    try:
+        if time.time() - os.path.getmtime(path) < min_age:
+            return False
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def purge_tmp_files(upload_folder: str, min_age: float):
+    """Remove partial uploads left in blobs/tmp by interrupted requests."""
+    tmp_dir = os.path.join(upload_folder, BLOB_FOLDER, 'tmp')
+    if not os.path.isdir(tmp_dir):
+        return 0
+    return sum(purge_blob_file(os.path.join(tmp_dir, name), min_age) for name in os.listdir(tmp_dir))
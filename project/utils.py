@@ -1,3 +1,4 @@
+from datetime import date
 from uuid import uuid4
 from flask import session
 
@@ -12,6 +13,37 @@ def is_allowed_file(filename):
     return ('.' in filename and 
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS)
 
+# Gallery cursors: '<updateDate>_<imageID>' of the first/last image on a page
+def encode_cursor(updateDate, imageID):
+    if hasattr(updateDate, 'date'):
+        updateDate = updateDate.date()
+    return f'{updateDate.isoformat()}_{imageID}'
+
+
+def decode_cursor(cursor):
+    # returns (date, imageID) or None for a missing/invalid cursor
+    if not cursor:
+        return None
+    try:
+        day, imageID = cursor.split('_', 1)
+        return date.fromisoformat(day), imageID
+    except ValueError:
+        return None
+
+# Search cursors: '<relevance>_<imageID>' of the last result on a page
+def encode_search_cursor(relevance, imageID):
+    return f'{float(relevance)!r}_{imageID}'
+
+
+def decode_search_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        relevance, imageID = cursor.split('_', 1)
+        return float(relevance), imageID
+    except ValueError:
+        return None
+
 # check if user is logged in
 def check_user_logged_in():
     if 'user' not in session or session['user']['userID'] == 0 or not session['logged_in']:
@@ -1,20 +1,29 @@
 from flask import (
     Blueprint, render_template, request, session, flash, current_app,
-    redirect, url_for, jsonify
+    redirect, url_for, jsonify, abort, send_from_directory, g, Response,
+    stream_with_context
 )
 from datetime import datetime
+import csv
+import io
 from hashlib import sha256
+import mimetypes
 import os
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 
 from project.db import (
-    add_image, add_purchase, config_image, config_user, count_images,
+    add_image, checkout_cart, config_image, config_user, count_images,
     delete_category, edit_category, edit_image, get_all_categories,
-    get_all_users, get_images_by_user_purchase, get_images_by_vendor,
-    get_images_sort, get_status_user, get_vendor, remove_all_image_cart,
-    add_customer, add_vendor, get_user, check_user, get_active_image,
-    add_to_cart, get_image_in_cart, remove_image_cart, get_image,
-    add_category, get_categories, get_customer, get_vendorName
+    get_users_page, iter_users, user_cursor, get_purchased_image_ids, get_images_by_vendor,
+    get_blob_twin, get_cache_version, get_images_page, search_images, get_status_user, get_vendors_by_ids,
+    remove_all_image_cart,
+    add_customer, add_vendor, get_user, check_user, get_best_seller_images,
+    get_new_images,
+    add_to_cart, get_cart_lines, get_cart_summary, summarize_cart_lines,
+    remove_image_cart, get_image,
+    add_category, get_categories, get_customer, get_vendorName,
+    get_job, get_job_stats, get_jobs, retry_job
 )
 
 from project.forms import (
@@ -24,14 +33,46 @@ from project.forms import (
 from project.models import Currency, Image, Role, Category
 
 from project.utils import (
-    is_allowed_file, generate_uuid, check_user_logged_in
+    is_allowed_file, generate_uuid, check_user_logged_in, encode_cursor,
+    decode_cursor, encode_search_cursor, decode_search_cursor
 )
 
+from project import jobs, mysql
+from project.analytics import get_vendor_report
+from project.metrics import get_metrics
+from project.sessions import regenerate_session, revoke_user_sessions
+from project.fragments import (
+    apply_user_overlay, get_fragment_cache, render_gallery_fragment
+)
+from project.thumbnails import link_derivatives, schedule_derivatives
+from project.uploads import UploadTooLarge, link_file, store_upload
+
 from project.wrappers import only_admins, only_vendors
 
 
 bp = Blueprint('main', __name__)
 
+# number of images shown in each homepage section
+HOMEPAGE_FEED_SIZE = 4
+
+# admin user directory page size (the JSON API accepts up to USER_PAGE_MAX)
+USER_PAGE_SIZE = 50
+USER_PAGE_MAX = 500
+USER_EXPORT_COLUMNS = ['userID', 'username', 'email', 'firstname', 'surname', 'phone', 'role', 'isDeleted']
+
+# uploaded files are named by UUID and never change, so browsers may keep them for a year
+MEDIA_MAX_AGE = 365 * 24 * 60 * 60
+
+
+@bp.app_context_processor
+def inject_cart_summary():
+    # cart badge in the navbar (customers and vendors only)
+    if check_user_logged_in() == False or session['user']['role'] == Role.ADMIN.value:
+        return {}
+    if 'cart_summary' not in g:
+        g.cart_summary = get_cart_summary(session['user']['userID'])
+    return {'cart_summary': g.cart_summary}
+
 
 @bp.route('/manage/')
 def manage():
@@ -44,11 +85,121 @@ def manage():
         return redirect(url_for('main.index'))
     # now we know the user is logged in and is an admin
     categories = get_categories()
-    users = get_all_users()
-    return render_template('manage.html', categories=categories, users=users)
+    after = request.args.get('after') or None
+    before = request.args.get('before') or None
+    filters = _user_directory_filters()
+    users, has_more = get_users_page(after=after, before=before, per_page=USER_PAGE_SIZE, **filters)
+    if before:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after is not None, has_more
+    prev_cursor = user_cursor(users[0], **filters) if users and has_prev else None
+    next_cursor = user_cursor(users[-1], **filters) if users and has_next else None
+    return render_template('manage.html', categories=categories, users=users,
+                           filters=request.args, prev_cursor=prev_cursor, next_cursor=next_cursor)
+
+
+def _user_directory_filters():
+    # role, status (active/inactive), q (prefix) and field (username/email) query args
+    status = request.args.get('status')
+    return {
+        'role': request.args.get('role') or None,
+        'isDeleted': {'active': False, 'inactive': True}.get(status),
+        'prefix': request.args.get('q', '').strip() or None,
+        'prefixField': request.args.get('field', 'username'),
+    }
+
+
+@bp.route('/manage/users.json')
+@only_admins
+def users_api():
+    after = request.args.get('after') or None
+    limit = max(1, min(request.args.get('limit', USER_PAGE_SIZE, type=int), USER_PAGE_MAX))
+    filters = _user_directory_filters()
+    users, has_more = get_users_page(after=after, per_page=limit, **filters)
+    return jsonify({
+        'users': [{column: getattr(user, column) for column in USER_EXPORT_COLUMNS} | {'role': user.role.value}
+                  for user in users],
+        'next': user_cursor(users[-1], **filters) if users and has_more else None,
+    })
+
+
+def _csv_safe(value):
+    # keep spreadsheet apps from evaluating user-supplied text as a formula
+    value = '' if value is None else str(value)
+    return "'" + value if value[:1] in ('=', '+', '-', '@') else value
+
+
+@bp.route('/manage/users.csv')
+@only_admins
+def users_export():
+    filters = _user_directory_filters()
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(USER_EXPORT_COLUMNS)
+        for count, row in enumerate(iter_users(**filters), start=1):
+            writer.writerow([_csv_safe(row[column]) for column in USER_EXPORT_COLUMNS])
+            if count % 1000 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=users.csv'})
+
+
+@bp.route('/manage/db-pool')
+@only_admins
+def db_pool_stats():
+    # connection pool statistics, used to size MYSQL_POOL_SIZE under load
+    return jsonify(dict(mysql.pool.stats(), replicas=mysql.replica_stats()))
+
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    # Prometheus text format; counters are per process
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(403)
+    return Response(get_metrics().render(mysql.pool.stats()),
+                    mimetype='text/plain; version=0.0.4')
+
+
+@bp.route('/manage/jobs')
+@only_admins
+def job_overview():
+    # queue depth per kind/status, this process's workers and recent jobs
+    return jsonify({
+        'stats': get_job_stats(),
+        'workers': jobs.worker_stats(),
+        'jobs': get_jobs(status=request.args.get('status'),
+                         kind=request.args.get('kind'),
+                         limit=min(request.args.get('limit', 50, type=int), 500)),
+    })
+
+
+@bp.route('/manage/jobs/<int:job_id>')
+@only_admins
+def job_detail(job_id):
+    job = get_job(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job)
+
+
+@bp.route('/manage/jobs/<int:job_id>/retry', methods=['POST'])
+@only_admins
+def job_retry(job_id):
+    if not retry_job(job_id):
+        return jsonify({'retried': False, 'error': 'Job is not failed or is already queued again'}), 409
+    return jsonify({'retried': True, 'job': get_job(job_id)})
 
 
 @bp.route('/users/<user_id>/toggle', methods=['POST'])
+@only_admins
 def user_toggle(user_id):
     userStatus = get_status_user(user_id)
 
@@ -58,6 +209,9 @@ def user_toggle(user_id):
 
     new_status = not userStatus['isDeleted']
     config_user(user_id, new_status)
+    if new_status:
+        # a deactivated user is logged out everywhere straight away
+        revoke_user_sessions(user_id)
 
     msg = "User reactivated" if new_status == False else "User deactivated"
     flash(msg)
@@ -123,17 +277,16 @@ def cat_delete(category_id):
 @bp.route('/', methods=['GET', 'POST'])
 def index():
     userID = session['user']['userID'] if 'user' in session else None
-    images = get_active_image()
-    boughtImages = []
-    if (userID):
-        boughtImages = get_images_by_user_purchase(userID)
-    boughtIDImages = [img.imageID for img in boughtImages]
-    bestSaleImages = sorted(images, key=lambda x: x.quantity, reverse=True)
-    bestSaleImages_with_vendor = [
-        (img, get_vendor(img.userID)) for img in bestSaleImages]
-    newImages = sorted(images, key=lambda x: x.updateDate, reverse=True)
+    boughtIDImages = get_purchased_image_ids(userID) if userID else set()
+    bestSaleImages = get_best_seller_images(HOMEPAGE_FEED_SIZE)
+    newImages = get_new_images(HOMEPAGE_FEED_SIZE)
 
-    newImages_with_vendor = [(img, get_vendor(img.userID))
+    # Load every vendor on the page in one query
+    vendors = get_vendors_by_ids(
+        [img.userID for img in bestSaleImages + newImages])
+    bestSaleImages_with_vendor = [
+        (img, vendors.get(img.userID)) for img in bestSaleImages]
+    newImages_with_vendor = [(img, vendors.get(img.userID))
                              for img in newImages]
 
     return render_template('index.html', boughtIDImages=boughtIDImages, images=bestSaleImages_with_vendor, newImages=newImages_with_vendor, userID=userID)
@@ -145,10 +298,7 @@ def index():
 def item_detail(imageID):
     userID = session['user']['userID'] if 'user' in session else None
     item = get_image(imageID)
-    boughtImages = []
-    if (userID):
-        boughtImages = get_images_by_user_purchase(userID)
-    boughtIDImages = [img.imageID for img in boughtImages]
+    boughtIDImages = get_purchased_image_ids(userID) if userID else set()
     username = get_vendorName(item.userID)
     return render_template('item.html', item=item, username=username, userID=userID, boughtIDImages=boughtIDImages)
 
@@ -195,19 +345,16 @@ def clear_cart():
 def vendor():
     addImageForm = AddImageForm()
     userID = session['user']['userID']
-    addImageForm.categories.choices = get_all_categories()
+    # returns [(id, name), ...]
+    categoryChoices = get_all_categories()
+    addImageForm.categories.choices = categoryChoices
     vendor_images = get_images_by_vendor(userID)
 
-    cats = get_categories()
-    addImageForm.categories.choices = [
-        (c.categoryID, c.categoryName) for c in cats]
-
     edit_forms = {}
     for img in vendor_images:
         form = EditImageForm(obj=img)
         # Populate all available categories
-        # returns [(id, name), ...]
-        form.categories.choices = get_all_categories()
+        form.categories.choices = categoryChoices
         form.imageStatus.data = img.imageStatus
         # Pre-check the assigned categories
         form.categories.data = [c.categoryID for c in img.listCategory]
@@ -238,11 +385,25 @@ def vendor():
                     extension=os.path.splitext(
                         secure_filename(file.filename))[1]
                 )
-                save_path = os.path.join(
-                    current_app.config['UPLOAD_FOLDER'], imageUpload.imageID + imageUpload.extension)
-                file.save(save_path)
-
-                add_image(imageUpload)
+                upload_folder = current_app.config['UPLOAD_FOLDER']
+                try:
+                    # streamed to disk in chunks and stored once per SHA-256
+                    blob = store_upload(
+                        file, upload_folder, current_app.config['UPLOAD_MAX_BYTES'])
+                except UploadTooLarge:
+                    flash("Image is too large to upload", 'error')
+                    return redirect(url_for('main.vendor'))
+                imageUpload.blobHash = blob.sha256
+                twinID = None if blob.is_new else get_blob_twin(blob.sha256)
+                # the imageID + extension URL stays a plain file, linked to the blob
+                link_file(blob.path, os.path.join(
+                    upload_folder, imageUpload.imageID + imageUpload.extension))
+
+                add_image(imageUpload, blob.size)
+                # resized thumbnail/card/hero copies are built in the background,
+                # unless an identical upload already has them
+                if not (twinID and link_derivatives(upload_folder, twinID, imageUpload.imageID)):
+                    schedule_derivatives(imageUpload.imageID, imageUpload.extension)
                 flash("Image uploaded successfully")
                 return redirect(url_for('main.vendor'))
             else:
@@ -253,6 +414,21 @@ def vendor():
 # To update image's details in vendor.html page
 
 
+@bp.route('/vendor/analytics')
+@only_vendors
+def vendor_analytics():
+    numDays = request.args.get('days', 90, type=int)
+    report = get_vendor_report(session['user']['userID'], numDays)
+    return render_template('vendor_analytics.html', report=report, numDays=numDays)
+
+
+@bp.route('/vendor/analytics.json')
+@only_vendors
+def vendor_analytics_json():
+    numDays = request.args.get('days', 90, type=int)
+    return jsonify(get_vendor_report(session['user']['userID'], numDays))
+
+
 @bp.route('/vendor/edit_image/<imageID>', methods=['POST'])
 @only_vendors
 def update_image(imageID):
@@ -317,31 +493,114 @@ def gallery():
     userID = session['user']['userID'] if 'user' in session else None
     categories = get_all_categories()
     category_id = request.args.get('category', 'all')
-    page = int(request.args.get('page', 1))
+    page = max(request.args.get('page', 1, type=int), 1)
+    after = decode_cursor(request.args.get('after'))
+    before = decode_cursor(request.args.get('before'))
     per_page = 8
 
-    images = get_images_sort(
-        page=page, per_page=per_page, category_id=category_id)
+    # The card grid is cached per (category, cursor, catalog version); image
+    # writes bump the catalog version, which retires every cached page
+    key = (category_id, after, before, per_page,
+           get_cache_version('catalog'))
+    fragment = get_fragment_cache().get(key)
+    if fragment is None:
+        images, has_more = get_images_page(
+            category_id=category_id, after=after, before=before, per_page=per_page)
+        fragment = render_gallery_fragment(images, has_more)
+        get_fragment_cache().set(key, fragment)
+    has_more = fragment.has_more
     total = count_images(category_id)
     total_pages = (total + per_page - 1) // per_page
 
-    boughtIDImages = []
-    if (userID):
-        boughtImages = get_images_by_user_purchase(userID)
-        if (boughtImages):
-            boughtIDImages = [row.imageID for row in boughtImages]
+    # cursors for the neighbouring pages
+    if before:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after is not None, has_more
+    if not has_prev:
+        page = 1
+    prev_cursor = next_cursor = None
+    if fragment.first and has_prev:
+        prev_cursor = encode_cursor(*fragment.first)
+    if fragment.last and has_next:
+        next_cursor = encode_cursor(*fragment.last)
+
+    boughtIDImages = get_purchased_image_ids(userID) if userID else set()
 
     return render_template(
         'gallery.html',
-        images=images,
-        boughtIDImages=boughtIDImages,
-        userID=userID,
+        grid=apply_user_overlay(fragment, boughtIDImages, userID),
+        image_count=fragment.image_count,
         page=page,
         total_pages=total_pages,
+        prev_cursor=prev_cursor,
+        next_cursor=next_cursor,
+        selected_category=category_id,
         categories=categories
     )
 
 
+@bp.route('/search')
+def search():
+    userID = session['user']['userID'] if 'user' in session else None
+    query = request.args.get('q', '').strip()
+    category_id = request.args.get('category', 'all')
+    after = decode_search_cursor(request.args.get('after'))
+    per_page = 8
+
+    images, has_more = [], False
+    if query:
+        images, has_more = search_images(
+            query, category_id=category_id, after=after, per_page=per_page)
+    next_cursor = None
+    if images and has_more:
+        next_cursor = encode_search_cursor(
+            images[-1]['relevance'], images[-1]['imageID'])
+
+    boughtIDImages = get_purchased_image_ids(userID) if userID else set()
+    fragment = render_gallery_fragment(images, has_more)
+
+    return render_template(
+        'search.html',
+        query=query,
+        grid=apply_user_overlay(fragment, boughtIDImages, userID),
+        image_count=len(images),
+        next_cursor=next_cursor,
+        is_first_page=after is None,
+        selected_category=category_id,
+        categories=get_all_categories()
+    )
+
+
+# Serve uploaded images and their derivatives with far-future caching.
+# Conditional requests (ETag/If-None-Match) and Range requests are handled by send_file.
+# When MEDIA_ACCEL_REDIRECT is set, a fronting nginx sends the file instead (X-Accel-Redirect).
+
+
+@bp.route('/media/<path:filename>')
+def media(filename):
+    upload_folder = os.path.abspath(current_app.config['UPLOAD_FOLDER'])
+    accel_prefix = current_app.config.get('MEDIA_ACCEL_REDIRECT')
+
+    if accel_prefix:
+        path = safe_join(upload_folder, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        response = current_app.response_class()
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip(
+            '/') + '/' + filename
+        response.content_type = mimetypes.guess_type(
+            filename)[0] or 'application/octet-stream'
+    else:
+        response = send_from_directory(
+            upload_folder, filename, max_age=MEDIA_MAX_AGE, conditional=True, etag=True)
+
+    response.cache_control.public = True
+    response.cache_control.max_age = MEDIA_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
 @bp.route('/register/', methods=['POST', 'GET'])
 def register():
     form = RegisterForm()
@@ -382,6 +641,8 @@ def login():
             if not user:
                 flash('Invalid username or password', 'error')
                 return redirect(url_for('main.login'))
+            # new session ID on login, so an ID planted before login is useless
+            regenerate_session()
             # Store full user info in session
             session['user'] = {
                 'userID': user.userID,
@@ -414,10 +675,10 @@ def checkout():
         flash('Please log in before checkout', 'error')
         return redirect(url_for('main.login'))
     userID = session['user']['userID']
-    listImage = get_image_in_cart(userID)
-    totalPrice = 0.0
-    if (listImage or len(listImage) > 0):
-        totalPrice = round(sum(image.price for image in listImage), 2)
+    listImage = get_cart_lines(userID)
+    cartSummary = summarize_cart_lines(listImage)
+    # reuse it for the navbar badge instead of querying again
+    g.cart_summary = cartSummary
     customerInfor = get_customer(userID)
 
     # form = CheckoutForm()
@@ -425,13 +686,20 @@ def checkout():
 
     if request.method == 'POST':
         if formPayment.validate_on_submit():
-            remove_all_image_cart(userID)
-            add_purchase(userID, listImage)
-            flash('Payment successful')
+            purchaseID = checkout_cart(userID, formPayment.checkoutToken.data)
+            if purchaseID is False:
+                flash('Payment failed, please try again', 'error')
+            elif purchaseID is None:
+                flash('Your cart is empty', 'error')
+            else:
+                flash('Payment successful')
             return redirect(url_for('main.checkout'))
         else:
             flash('The provided information is missing or incorrect', 'error')
 
+    if not formPayment.checkoutToken.data:
+        formPayment.checkoutToken.data = generate_uuid()
+
     formPayment.firstname.data = session['user']['firstname']
     formPayment.surname.data = session['user']['surname']
     formPayment.email.data = session['user']['email']
@@ -441,6 +709,6 @@ def checkout():
         'checkout.html',
         formPayment=formPayment,
         listImage=listImage,
-        totalPrice=totalPrice,
+        cartSummary=cartSummary,
         customerInfor=customerInfor
     )